@@ -8,6 +8,12 @@ git -C /opt/star-burger pull
 npm ci --dev --prefix /opt/star-burger
 /opt/star-burger/myvenv/bin/python3.10 /opt/star-burger/manage.py collectstatic --noinput
 /opt/star-burger/myvenv/bin/python3.10 /opt/star-burger/manage.py migrate --noinput
+mkdir -p /opt/star-burger/media/banners
+for image in burger.jpg food.jpg tasty.jpg; do
+  [ -e /opt/star-burger/media/banners/$image ] || cp /opt/star-burger/assets/$image /opt/star-burger/media/banners/
+done
+/opt/star-burger/myvenv/bin/python3.10 /opt/star-burger/manage.py createcachetable
+/opt/star-burger/myvenv/bin/python3.10 /opt/star-burger/manage.py check --deploy --fail-level ERROR
 systemctl restart star-burger-web.target
 systemctl reload nginx
 http POST https://api.rollbar.com/api/1/deploy X-Rollbar-Access-Token:$ROLLBAR_TOKEN environment=$ROLLBAR_ENV revision=$(git rev-parse --verify HEAD) rollbar_username=pcorpx comment="new deploy" status=succeeded
@@ -8,13 +8,13 @@ from django.shortcuts import redirect
 from django.utils.http import url_has_allowed_host_and_scheme
 from django.conf import settings
 
+from .models import Banner
 from .models import Product
 from .models import ProductCategory
 from .models import Restaurant
 from .models import RestaurantMenuItem
 from .models import Order, OrderElement
-from locations.models import Location
-from locations.locator import fetch_coordinates
+from locations.models import GeocodingJob
 
 class RestaurantMenuItemInline(admin.TabularInline):
     model = RestaurantMenuItem
@@ -51,6 +51,9 @@ class ProductAdmin(admin.ModelAdmin):
     list_display_links = [
         'name',
     ]
+    list_select_related = [
+        'category',
+    ]
     list_filter = [
         'category',
     ]
@@ -115,30 +118,93 @@ class ProductAdmin(admin.ModelAdmin):
     pass
 
 
+@admin.register(Banner)
+class BannerAdmin(admin.ModelAdmin):
+    list_display = [
+        'get_image_list_preview',
+        'title',
+        'position',
+        'is_active',
+        'starts_at',
+        'ends_at',
+    ]
+    list_display_links = [
+        'title',
+    ]
+    list_editable = [
+        'position',
+        'is_active',
+    ]
+    list_filter = [
+        'is_active',
+    ]
+    fields = [
+        'title',
+        'text',
+        'image',
+        'get_image_preview',
+        'position',
+        'is_active',
+        'starts_at',
+        'ends_at',
+    ]
+    readonly_fields = [
+        'get_image_preview',
+    ]
+
+    def get_image_preview(self, obj):
+        if not obj.image:
+            return 'выберите картинку'
+        return format_html('<img src="{url}" style="max-height: 200px;"/>', url=obj.image.url)
+    get_image_preview.short_description = 'превью'
+
+    def get_image_list_preview(self, obj):
+        if not obj.image:
+            return 'нет картинки'
+        return format_html('<img src="{src}" style="max-height: 50px;"/>', src=obj.image.url)
+    get_image_list_preview.short_description = 'превью'
+
+
 class OrderElementInline(admin.TabularInline):
     model = OrderElement
     extra = 0
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product')
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        field = super().formfield_for_foreignkey(db_field, request, **kwargs)
+        if db_field.name == 'product':
+            # every inline row would otherwise query the whole menu again
+            if not hasattr(request, 'product_choices'):
+                request.product_choices = list(field.choices)
+            field.choices = request.product_choices
+        return field
+
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     fields = ['address', 'lastname', 'firstname', 'phonenumber', 'status',
               'payment', 'comment', 'registered_at', 'called_at',
               'delivered_at', 'assigned_restaurant']
-    list_display = ['display_order']
+    list_display = ['display_order', 'total']
     inlines = [
         OrderElementInline
     ]
 
+    def save_formset(self, request, form, formset, change):
+        if formset.model is OrderElement:
+            for element_form in formset.forms:
+                element_form.instance.recalculate_order_total = False
+        super().save_formset(request, form, formset, change)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        Order.objects.filter(pk=form.instance.pk).recalculate_totals()
+
     def response_post_save_change(self, request, obj):
         res = super().response_post_save_change(request, obj)
-        location, created = Location.objects.get_or_create(
-            address=obj.address,
-        )
-        if created:
-            coords = fetch_coordinates(location.address)
-            location.lat, location.lon = coords if coords else None, None
-            location.save()
+        GeocodingJob.objects.enqueue([obj.address])
 
         if ("next" in request.GET and
            url_has_allowed_host_and_scheme(
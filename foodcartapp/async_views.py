@@ -0,0 +1,45 @@
+import json
+
+from django.http import HttpResponseNotAllowed
+from rest_framework.exceptions import ValidationError
+
+from star_burger.db import database_sync_to_async
+from . import views
+from .banners import get_banners
+from .caching import payload_response
+from .catalogue import get_catalogue
+from .renderers import json_response
+
+
+async def banners_list_api(request):
+    banners = await database_sync_to_async(get_banners)()
+    return payload_response(request, banners)
+
+
+async def product_list_api(request):
+    catalogue = await database_sync_to_async(get_catalogue)()
+    return payload_response(request, catalogue)
+
+
+async def register_order(request):
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return json_response(request, {'detail': 'Ожидается JSON.'},
+                             status=400)
+    try:
+        response_data, status_code, headers = await database_sync_to_async(
+            views.register_order_data,
+        )(data, request.headers.get('Idempotency-Key'))
+    except ValidationError as err:
+        return json_response(request, err.detail, status=400)
+    response = json_response(request, response_data, status=status_code)
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+
+# csrf_exempt() would wrap the view into a sync function
+register_order.csrf_exempt = True
@@ -0,0 +1,87 @@
+import base64
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from .caching import encode_payload
+from .catalogue import invalidate_catalogue
+from .models import Product, Restaurant, RestaurantMenuItem
+
+
+AVAILABILITY_CACHE_KEY = 'availability_matrix'
+
+
+def build_availability_matrix():
+    """Products x restaurants availability as a base64 bitmap.
+
+    Bit number product_index * len(restaurants) + restaurant_index is set
+    when the product is on sale in the restaurant, most significant bit of
+    each byte first.
+    """
+    products = list(
+        Product.objects.order_by('id')
+        .values_list('id', 'name', 'category__name', 'price', 'image')
+    )
+    restaurants = list(
+        Restaurant.objects.order_by('name').values_list('id', 'name')
+    )
+    product_indexes = {product[0]: index
+                       for index, product in enumerate(products)}
+    restaurant_indexes = {restaurant[0]: index
+                          for index, restaurant in enumerate(restaurants)}
+
+    bitmap = bytearray((len(products) * len(restaurants) + 7) // 8)
+    menu_items = (
+        RestaurantMenuItem.objects
+        .filter(availability=True)
+        .values_list('product_id', 'restaurant_id')
+    )
+    for product_id, restaurant_id in menu_items:
+        bit = (product_indexes[product_id] * len(restaurants)
+               + restaurant_indexes[restaurant_id])
+        bitmap[bit // 8] |= 0x80 >> (bit % 8)
+
+    return {
+        'products': [
+            {
+                'id': product_id,
+                'name': name,
+                'category': category,
+                'price': price,
+                'image': default_storage.url(image) if image else None,
+            }
+            for product_id, name, category, price, image in products
+        ],
+        'restaurants': [
+            {'id': restaurant_id, 'name': name}
+            for restaurant_id, name in restaurants
+        ],
+        'availability': base64.b64encode(bitmap).decode(),
+    }
+
+
+def get_availability_matrix():
+    matrix = cache.get(AVAILABILITY_CACHE_KEY)
+    if matrix is None:
+        matrix = encode_payload(build_availability_matrix())
+        cache.set(AVAILABILITY_CACHE_KEY, matrix,
+                  timeout=settings.CATALOGUE_CACHE_TIMEOUT)
+    return matrix
+
+
+def invalidate_availability_matrix():
+    cache.delete(AVAILABILITY_CACHE_KEY)
+
+
+def set_menu_availability(changes):
+    """Apply availability changes and drop the dependent caches once."""
+    with transaction.atomic():
+        changed, unknown_pairs = RestaurantMenuItem.objects.set_availability(
+            changes
+        )
+        if changed:
+            transaction.on_commit(invalidate_availability_matrix)
+            transaction.on_commit(invalidate_catalogue)
+    return changed, unknown_pairs
@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .caching import encode_payload
+from .models import Banner
+
+
+BANNERS_CACHE_KEY = 'banners'
+
+
+def serialize_banners(banners):
+    return [
+        {
+            'title': banner.title,
+            'src': banner.image.url,
+            'text': banner.text,
+        }
+        for banner in banners
+    ]
+
+
+def get_banners():
+    """Return the encoded list of banners shown now.
+
+    The payload is cached until a banner changes or, if sooner, until the
+    next start or end of a banner's display window.
+    """
+    payload = cache.get(BANNERS_CACHE_KEY)
+    if payload is None:
+        now = timezone.now()
+        banners = list(Banner.objects.filter(is_active=True))
+        payload = encode_payload(serialize_banners(
+            banner for banner in banners if banner.is_shown_at(now)
+        ))
+        timeout = settings.BANNERS_CACHE_TIMEOUT
+        for banner in banners:
+            for moment in [banner.starts_at, banner.ends_at]:
+                if moment is not None and moment > now:
+                    timeout = min(timeout,
+                                  (moment - now).total_seconds() + 1)
+        cache.set(BANNERS_CACHE_KEY, payload, timeout=timeout)
+    return payload
+
+
+def invalidate_banners():
+    cache.delete(BANNERS_CACHE_KEY)
@@ -0,0 +1,95 @@
+import gzip
+import hashlib
+import json
+
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import http_date
+
+from .renderers import dumps, wants_pretty
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# smaller payloads do not win enough to pay for the Content-Encoding
+COMPRESS_MIN_SIZE = 1024
+
+
+def compress(content):
+    """Return the content encoded with each supported Content-Encoding."""
+    if len(content) < COMPRESS_MIN_SIZE:
+        return {}
+    encoded = {'gzip': gzip.compress(content, mtime=0)}
+    if brotli is not None:
+        encoded['br'] = brotli.compress(content)
+    return encoded
+
+
+def choose_encoding(request, encodings):
+    """Pick the best of encodings the client accepts, br over gzip."""
+    accepted = {}
+    for coding in request.headers.get('Accept-Encoding', '').split(','):
+        name, *params = coding.split(';')
+        quality = 1.0
+        for param in params:
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in ['br', 'gzip']:
+        if encoding in encodings and accepted.get(
+            encoding, accepted.get('*', 0),
+        ) > 0:
+            return encoding
+    return None
+
+
+def encode_payload(data):
+    """Encode data once into a cacheable payload with its ETag.
+
+    Large payloads are compressed up front too, so cached responses are
+    served without encoding anything per request.
+    """
+    content = dumps(data)
+    return {
+        'content': content,
+        'encoded': compress(content),
+        'etag': '"{}"'.format(hashlib.md5(content).hexdigest()),
+        'last_modified': timezone.now(),
+    }
+
+
+def payload_response(request, payload):
+    last_modified = int(payload['last_modified'].timestamp())
+    response = get_conditional_response(
+        request,
+        etag=payload['etag'],
+        last_modified=last_modified,
+    )
+    etag = payload['etag']
+    if response is None:
+        encoding = None
+        if wants_pretty(request):
+            content = dumps(json.loads(payload['content']), pretty=True)
+        else:
+            encoding = choose_encoding(request, payload['encoded'])
+            content = payload['encoded'].get(encoding, payload['content'])
+        response = HttpResponse(content, content_type='application/json')
+        if encoding:
+            response['Content-Encoding'] = encoding
+        if content is not payload['content']:
+            # same data, other bytes: a strong ETag must not be shared
+            etag = f'W/{etag}'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, no_cache=True)
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from .caching import encode_payload
+from .models import Product
+
+
+CATALOGUE_CACHE_KEY = 'product_catalogue'
+
+
+def serialize_products(products):
+    dumped_products = []
+    for product in products:
+        dumped_product = {
+            'id': product.id,
+            'name': product.name,
+            'price': product.price,
+            'special_status': product.special_status,
+            'description': product.description,
+            'category': {
+                'id': product.category.id,
+                'name': product.category.name,
+            } if product.category else None,
+            'image': product.image.url,
+            'restaurant': {
+                'id': product.id,
+                'name': product.name,
+            }
+        }
+        dumped_products.append(dumped_product)
+    return dumped_products
+
+
+def get_catalogue():
+    catalogue = cache.get(CATALOGUE_CACHE_KEY)
+    if catalogue is None:
+        products = Product.objects.select_related('category').available()
+        catalogue = encode_payload(serialize_products(products))
+        cache.set(CATALOGUE_CACHE_KEY, catalogue,
+                  timeout=settings.CATALOGUE_CACHE_TIMEOUT)
+    return catalogue
+
+
+def invalidate_catalogue():
+    cache.delete(CATALOGUE_CACHE_KEY)
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+
+@register(deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """Warn when the cache is private to each process.
+
+    The catalogue, banners, availability matrix and restaurant index are
+    invalidated through the cache, so every worker has to share it.
+    """
+    if settings.CACHES['default']['BACKEND'].endswith('.LocMemCache'):
+        return [Warning(
+            'Кэш LocMemCache у каждого процесса свой: после изменения '
+            'товаров, меню и баннеров остальные процессы до часа отдают '
+            'устаревшие данные.',
+            hint='Укажите общий кэш в CACHE_BACKEND и CACHE_LOCATION.',
+            id='foodcartapp.W001',
+        )]
+    return []
@@ -0,0 +1,109 @@
+from collections import defaultdict
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Case, Count, IntegerField, Value, When
+from django.db.models.functions import Now
+
+from locations.distance import distance_matrix
+from locations.locator import geocoder
+from .models import Order, Restaurant
+
+
+def kitchen_load(restaurant_ids):
+    """Count orders assigned to each restaurant and not yet delivered."""
+    load = (
+        Order.objects
+        .filter(assigned_restaurant__in=restaurant_ids,
+                status__in=[Order.UNPROCESSED, Order.COOKING])
+        .order_by()
+        .values_list('assigned_restaurant')
+        .annotate(count=Count('id'))
+    )
+    return dict(load)
+
+
+def dispatch_orders(orders=None):
+    """Assign a restaurant to every unprocessed order that has none.
+
+    Candidates are restaurants able to cook the whole order within
+    ORDER_RESTAURANTS_RADIUS_KM of the customer. The one with the lowest
+    distance plus DISPATCH_LOAD_PENALTY_KM per order already in its kitchen
+    wins, and orders are served first come first served, so a busy
+    restaurant hands work over to its neighbours. Orders whose address
+    has not been geocoded yet are left for a later pass.
+
+    Returns a dict of order id to the assigned restaurant id.
+    """
+    if orders is None:
+        orders = Order.objects.all()
+    orders = list(
+        orders.filter(status=Order.UNPROCESSED,
+                      assigned_restaurant__isnull=True)
+              .prefetch_related('elements')
+              .order_by('registered_at', 'id')
+    )
+    if not orders:
+        return {}
+    candidates = Restaurant.objects.filter(lat__isnull=False) \
+                                   .available_for(orders)
+    customer_coords = geocoder.lookup_many(
+        {order.address for order in orders}, upstream=False,
+    )
+    orders = [order for order in orders
+              if customer_coords.get(order.address) and candidates[order.id]]
+    if not orders:
+        return {}
+
+    restaurants = {restaurant.id: restaurant
+                   for order in orders for restaurant in candidates[order.id]}
+    restaurant_ids = list(restaurants)
+    columns = {restaurant_id: column
+               for column, restaurant_id in enumerate(restaurant_ids)}
+    distances = distance_matrix(
+        [customer_coords[order.address] for order in orders],
+        [(restaurants[restaurant_id].lat, restaurants[restaurant_id].lon)
+         for restaurant_id in restaurant_ids],
+    )
+    current_load = kitchen_load(restaurant_ids)
+    load = np.array([current_load.get(restaurant_id, 0)
+                     for restaurant_id in restaurant_ids], dtype=float)
+
+    assignments = {}
+    for order, order_distances in zip(orders, distances):
+        order_columns = np.array([columns[restaurant.id] for restaurant
+                                  in candidates[order.id]])
+        km = order_distances[order_columns]
+        scores = km + load[order_columns] * settings.DISPATCH_LOAD_PENALTY_KM
+        scores[km > settings.ORDER_RESTAURANTS_RADIUS_KM] = np.inf
+        best = int(np.argmin(scores))
+        if np.isinf(scores[best]):
+            continue
+        column = order_columns[best]
+        assignments[order.id] = restaurant_ids[column]
+        load[column] += 1
+
+    if assignments:
+        assign_restaurants(assignments)
+    return assignments
+
+
+def assign_restaurants(assignments):
+    """Save assignments in one UPDATE, skipping orders taken meanwhile."""
+    order_ids_by_restaurant = defaultdict(list)
+    for order_id, restaurant_id in assignments.items():
+        order_ids_by_restaurant[restaurant_id].append(order_id)
+    return (
+        Order.objects
+        .filter(pk__in=assignments, status=Order.UNPROCESSED,
+                assigned_restaurant__isnull=True)
+        .update(
+            assigned_restaurant=Case(
+                *[When(pk__in=order_ids, then=Value(restaurant_id))
+                  for restaurant_id, order_ids
+                  in order_ids_by_restaurant.items()],
+                output_field=IntegerField(),
+            ),
+            updated_at=Now(),
+        )
+    )
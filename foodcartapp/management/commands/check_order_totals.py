@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from foodcartapp.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Сверяет сохранённые суммы заказов с их составом'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true',
+                            help='Пересчитать расходящиеся суммы')
+
+    def handle(self, *args, **options):
+        drifted_ids = list(
+            Order.objects.with_calculated_totals()
+                 .exclude(total=F('calculated_total'))
+                 .values_list('id', flat=True)
+        )
+        self.stdout.write(f'Заказов с неверной суммой: {len(drifted_ids)}')
+        if drifted_ids and options['repair']:
+            repaired = Order.objects.filter(pk__in=drifted_ids) \
+                                    .recalculate_totals()
+            self.stdout.write(f'Исправлено: {repaired}')
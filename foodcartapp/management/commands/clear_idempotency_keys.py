@@ -0,0 +1,19 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from foodcartapp.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = 'Удаляет устаревшие ключи идемпотентности заказов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=48,
+                            help='Сколько часов хранить ключи')
+
+    def handle(self, *args, **options):
+        deleted, _ = IdempotencyKey.objects.expired(
+            timedelta(hours=options['hours'])
+        ).delete()
+        self.stdout.write(f'Удалено ключей: {deleted}')
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from foodcartapp.dispatch import dispatch_orders
+
+
+class Command(BaseCommand):
+    help = 'Назначает рестораны необработанным заказам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float,
+                            help='Повторять каждые столько секунд')
+
+    def handle(self, *args, **options):
+        while True:
+            assignments = dispatch_orders()
+            self.stdout.write(f'Назначено заказов: {len(assignments)}')
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,321 @@
+import argparse
+import json
+import logging
+import random
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter, sleep
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from foodcartapp.models import Order, Product
+from locations.addresses import address_key
+from locations.models import GeocodingJob, Location
+
+
+ADDRESSES = [
+    'Москва, Тверская улица, 1',
+    'Москва, Новый Арбат, 15',
+    'Москва, Ленинградский проспект, 37',
+    'Москва, Профсоюзная улица, 56',
+    'Москва, улица Покровка, 2',
+]
+
+
+def generate_orders(count, seed=0):
+    rng = random.Random(seed)
+    product_ids = list(Product.objects.available().values_list('id',
+                                                               flat=True))
+    if not product_ids:
+        raise CommandError('Нет товаров, доступных для заказа')
+    return [
+        {
+            'firstname': 'Иван',
+            'lastname': f'Нагрузочный {number}',
+            'phonenumber': '+79123456789',
+            'address': rng.choice(ADDRESSES),
+            'products': [
+                {'product': product_id, 'quantity': rng.randint(1, 3)}
+                for product_id in rng.sample(product_ids,
+                                             min(len(product_ids),
+                                                 rng.randint(1, 5)))
+            ],
+        }
+        for number in range(count)
+    ]
+
+
+def read_orders(path):
+    with open(path, encoding='utf-8') as payloads:
+        return [json.loads(line) for line in payloads if line.strip()]
+
+
+def positive_float(value):
+    number = float(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError('должно быть больше нуля')
+    return number
+
+
+def percentile(sorted_values, share):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(share * len(sorted_values)))
+    return sorted_values[index]
+
+
+class LocalTarget:
+    """Calls the views in this process, counting SQL queries per request.
+
+    Everything the run adds to the database is removed by cleanup(): the
+    orders, and the geocoding jobs and locations of their addresses unless
+    those existed before the run.
+    """
+
+    queries_counted = True
+
+    def __init__(self, host, addresses):
+        self.host = host
+        self._clients = threading.local()
+        self.order_ids = []
+        self._lock = threading.Lock()
+        self.addresses = set(addresses)
+        keys = {address_key(address) for address in self.addresses}
+        self.known_keys = set(
+            Location.objects.filter(key__in=keys)
+                    .values_list('key', flat=True)
+        ) | set(
+            GeocodingJob.objects.filter(key__in=keys)
+                        .values_list('key', flat=True)
+        )
+
+    def request(self, kind, payload):
+        client = getattr(self._clients, 'client', None)
+        if client is None:
+            client = self._clients.client = Client(
+                raise_request_exception=False, HTTP_HOST=self.host,
+            )
+        queries = []
+        with connection.execute_wrapper(
+            lambda execute, *args: queries.append(1) or execute(*args)
+        ):
+            if kind == 'order':
+                response = client.post(
+                    reverse('foodcartapp:register_order'), payload,
+                    content_type='application/json',
+                )
+            else:
+                response = client.get(
+                    reverse('foodcartapp:product_list_api'),
+                )
+        if kind == 'order' and response.status_code == 200:
+            with self._lock:
+                self.order_ids.append(response.json()['id'])
+        return response.status_code, len(queries)
+
+    def cleanup(self):
+        Order.objects.filter(pk__in=self.order_ids).delete()
+        # real orders placed during the run may share an address
+        used_addresses = Order.objects.filter(
+            address__in=self.addresses,
+        ).values_list('address', flat=True)
+        keys = (
+            {address_key(address) for address in self.addresses}
+            - {address_key(address) for address in used_addresses}
+            - self.known_keys
+        )
+        GeocodingJob.objects.filter(key__in=keys).delete()
+        Location.objects.filter(key__in=keys).delete()
+
+
+class RemoteTarget:
+    queries_counted = False
+
+    def __init__(self, url, timeout):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self._sessions = threading.local()
+
+    def request(self, kind, payload):
+        session = getattr(self._sessions, 'session', None)
+        if session is None:
+            session = self._sessions.session = requests.Session()
+        try:
+            if kind == 'order':
+                response = session.post(f'{self.url}/api/order/',
+                                        json=payload, timeout=self.timeout)
+            else:
+                response = session.get(f'{self.url}/api/products/',
+                                       timeout=self.timeout)
+        except requests.exceptions.RequestException:
+            return None, None
+        return response.status_code, None
+
+    def cleanup(self):
+        pass
+
+
+class Command(BaseCommand):
+    help = 'Нагружает API заказов и каталога и считает задержки'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url',
+                            help='Адрес сайта, по умолчанию запросы '
+                                 'выполняются в этом процессе')
+        parser.add_argument('--replay',
+                            help='JSONL файл с заказами для отправки')
+        parser.add_argument('--save',
+                            help='Сохранить сгенерированные заказы в JSONL '
+                                 'файл и выйти')
+        parser.add_argument('--requests', type=int, default=1000,
+                            help='Сколько всего запросов отправить')
+        parser.add_argument('--rps', type=positive_float, default=50,
+                            help='Целевое число запросов в секунду')
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--catalogue-share', type=float, default=0.2,
+                            help='Доля запросов к каталогу товаров')
+        parser.add_argument('--timeout', type=float, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--allow-local-db', action='store_true',
+                            help='Разрешить прогон в этом процессе на базе '
+                                 'из DATABASE_URL при DEBUG=false')
+        parser.add_argument('--keep', action='store_true',
+                            help='Не удалять созданные заказы после '
+                                 'локального прогона')
+        parser.add_argument('--report',
+                            help='Записать итоги в JSON файл для сравнения '
+                                 'релизов')
+
+    def handle(self, *args, **options):
+        if options['rps'] <= 0:
+            raise CommandError('--rps должен быть больше нуля')
+        if not (options['url'] or options['save'] or settings.DEBUG
+                or options['allow_local_db']):
+            raise CommandError(
+                'Без --url заказы создаются прямо в базе из DATABASE_URL. '
+                'На рабочем сервере укажите --url, а для прогона в этом '
+                'процессе включите DEBUG или добавьте --allow-local-db'
+            )
+        if options['replay']:
+            orders = read_orders(options['replay'])
+        else:
+            orders = generate_orders(options['requests'], options['seed'])
+        if options['save']:
+            with open(options['save'], 'w', encoding='utf-8') as payloads:
+                for order in orders:
+                    payloads.write(json.dumps(order, ensure_ascii=False))
+                    payloads.write('\n')
+            self.stdout.write(f'Сохранено заказов: {len(orders)}')
+            return
+        if not orders:
+            raise CommandError('Нет заказов для отправки')
+
+        if options['url']:
+            target = RemoteTarget(options['url'], options['timeout'])
+        else:
+            host = next((host.lstrip('.') for host in settings.ALLOWED_HOSTS
+                         if host != '*'), 'localhost')
+            target = LocalTarget(
+                host, [order.get('address', '') for order in orders],
+            )
+            # failed requests are counted in the report instead
+            logging.getLogger('django.request').setLevel(logging.CRITICAL)
+
+        rng = random.Random(options['seed'])
+        plan = [
+            ('catalogue', None)
+            if rng.random() < options['catalogue_share']
+            else ('order', orders[number % len(orders)])
+            for number in range(options['requests'])
+        ]
+        try:
+            results, elapsed = run(target, plan, options['rps'],
+                                   options['workers'])
+        finally:
+            if not options['keep']:
+                target.cleanup()
+
+        report = summarize(results, elapsed, target.queries_counted)
+        self.print_report(report)
+        if options['report']:
+            with open(options['report'], 'w', encoding='utf-8') as output:
+                json.dump(report, output, indent=2)
+
+    def print_report(self, report):
+        self.stdout.write(
+            f'Запросов: {report["requests"]} за {report["seconds"]:.1f} с, '
+            f'{report["throughput"]:.1f} в секунду'
+        )
+        for kind, stats in report['endpoints'].items():
+            line = (
+                f'{kind}: {stats["requests"]} запросов, '
+                f'ошибок {stats["errors"]}, '
+                f'p50 {stats["p50_ms"]:.1f} мс, '
+                f'p95 {stats["p95_ms"]:.1f} мс, '
+                f'p99 {stats["p99_ms"]:.1f} мс'
+            )
+            if stats['queries_per_request'] is not None:
+                line += (f', SQL-запросов в среднем '
+                         f'{stats["queries_per_request"]:.1f}, '
+                         f'максимум {stats["max_queries"]}')
+            self.stdout.write(line)
+
+
+def run(target, plan, rps, workers):
+    """Send the planned requests at a fixed rate.
+
+    Latency is measured from the moment a request was due rather than sent,
+    so a backed-up server is not hidden by the generator slowing down.
+    """
+    results = []
+    lock = threading.Lock()
+    started_at = perf_counter()
+
+    def send(number):
+        kind, payload = plan[number]
+        due_at = started_at + number / rps
+        delay = due_at - perf_counter()
+        if delay > 0:
+            sleep(delay)
+        status, queries = target.request(kind, payload)
+        latency = perf_counter() - due_at
+        with lock:
+            results.append((kind, status, latency, queries))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(send, range(len(plan))))
+    return results, perf_counter() - started_at
+
+
+def summarize(results, elapsed, queries_counted):
+    by_kind = defaultdict(list)
+    for kind, status, latency, queries in results:
+        by_kind[kind].append((status, latency, queries))
+
+    endpoints = {}
+    for kind, kind_results in sorted(by_kind.items()):
+        latencies = sorted(latency * 1000 for _, latency, _ in kind_results)
+        queries = [count for _, _, count in kind_results]
+        endpoints[kind] = {
+            'requests': len(kind_results),
+            'errors': sum(1 for status, _, _ in kind_results
+                          if status is None or status >= 400),
+            'p50_ms': percentile(latencies, 0.50),
+            'p95_ms': percentile(latencies, 0.95),
+            'p99_ms': percentile(latencies, 0.99),
+            'queries_per_request': (sum(queries) / len(queries)
+                                    if queries_counted else None),
+            'max_queries': max(queries) if queries_counted else None,
+        }
+    return {
+        'requests': len(results),
+        'seconds': elapsed,
+        'throughput': len(results) / elapsed if elapsed else 0,
+        'endpoints': endpoints,
+    }
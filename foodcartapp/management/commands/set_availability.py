@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from foodcartapp.availability import set_menu_availability
+from foodcartapp.models import Restaurant
+
+
+class Command(BaseCommand):
+    help = 'Включает или снимает товары с продажи сразу во многих ресторанах'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--product', type=int, action='append',
+                            required=True, dest='products',
+                            help='id товара, можно указать несколько раз')
+        parser.add_argument('--restaurant', type=int, action='append',
+                            dest='restaurants',
+                            help='id ресторана, по умолчанию все рестораны')
+        switch = parser.add_mutually_exclusive_group(required=True)
+        switch.add_argument('--on', action='store_true')
+        switch.add_argument('--off', action='store_true')
+
+    def handle(self, *args, **options):
+        restaurant_ids = options['restaurants'] or list(
+            Restaurant.objects.values_list('id', flat=True)
+        )
+        changed, unknown_pairs = set_menu_availability({
+            (restaurant_id, product_id): options['on']
+            for restaurant_id in restaurant_ids
+            for product_id in options['products']
+        })
+        self.stdout.write(f'Изменено позиций меню: {changed}')
+        if unknown_pairs:
+            raise CommandError('Не найдены ресторан или товар для пар: {}'
+                               .format(unknown_pairs))
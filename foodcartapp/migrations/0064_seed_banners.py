@@ -0,0 +1,31 @@
+from django.db import migrations
+
+
+# The images are not copied to MEDIA_ROOT here, so that migrate stays free of
+# side effects, the test database included. The deploy script and README put
+# assets/*.jpg to media/banners/ instead.
+BANNERS = [
+    ('Burger', 'burger.jpg', 'Tasty Burger at your door step'),
+    ('Spices', 'food.jpg', 'All Cuisines'),
+    ('New York', 'tasty.jpg', 'Food is incomplete without a tasty dessert'),
+]
+
+
+def create_banners(apps, schema_editor):
+    Banner = apps.get_model('foodcartapp', 'Banner')
+    Banner.objects.bulk_create([
+        Banner(title=title, text=text, image=f'banners/{filename}',
+               position=position)
+        for position, (title, filename, text) in enumerate(BANNERS)
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0063_banner'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_banners, migrations.RunPython.noop),
+    ]
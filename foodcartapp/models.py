@@ -1,24 +1,43 @@
-from operator import index
-import requests
+import hashlib
+import json
+from collections import defaultdict
+
 from django.db import models
-from django.db.models import F, Sum
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Now
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MinValueValidator, MaxValueValidator
 from phonenumber_field.modelfields import PhoneNumberField
 from django.utils import timezone
 
 
 class RestaurantQuerySet(models.QuerySet):
-    def available(self, order):
-        available_restaurants = []
-        ordered_products = {element.product for element in
-                            order.elements.all()}
-
-        for restaurant in self:
-            available_products = {item.product for item in
-                                  restaurant.menu_items.all()
-                                  if item.availability}
-            if ordered_products.issubset(available_products):
-                available_restaurants.append(restaurant)
+    def menu_index(self):
+        index = defaultdict(set)
+        menu_items = (
+            RestaurantMenuItem.objects
+            .filter(restaurant__in=self, availability=True)
+            .values_list('product_id', 'restaurant_id')
+        )
+        for product_id, restaurant_id in menu_items:
+            index[product_id].add(restaurant_id)
+        return index
+
+    def available_for(self, orders):
+        restaurants = list(self)
+        index = self.menu_index()
+        all_restaurant_ids = {restaurant.id for restaurant in restaurants}
+        available_restaurants = {}
+        for order in orders:
+            restaurant_ids = set(all_restaurant_ids)
+            for element in order.elements.all():
+                restaurant_ids &= index.get(element.product_id, set())
+                if not restaurant_ids:
+                    break
+            available_restaurants[order.id] = [
+                restaurant for restaurant in restaurants
+                if restaurant.id in restaurant_ids
+            ]
         return available_restaurants
 
 
@@ -117,6 +136,57 @@ class Product(models.Model):
         return self.name
 
 
+class RestaurantMenuItemQuerySet(models.QuerySet):
+    def set_availability(self, changes):
+        """Apply {(restaurant_id, product_id): availability} in bulk.
+
+        Existing items are switched with one bulk_update and missing items
+        that should be on sale are inserted with one bulk_create. Returns
+        the number of changed items and the pairs with unknown ids.
+        """
+        restaurant_ids = {restaurant_id for restaurant_id, _ in changes}
+        product_ids = {product_id for _, product_id in changes}
+        known_restaurant_ids = set(
+            Restaurant.objects.filter(id__in=restaurant_ids)
+                              .values_list('id', flat=True)
+        )
+        known_product_ids = set(
+            Product.objects.filter(id__in=product_ids)
+                           .values_list('id', flat=True)
+        )
+        unknown_pairs = {
+            pair for pair in changes
+            if pair[0] not in known_restaurant_ids
+            or pair[1] not in known_product_ids
+        }
+
+        items = {
+            (item.restaurant_id, item.product_id): item
+            for item in self.filter(restaurant_id__in=known_restaurant_ids,
+                                    product_id__in=known_product_ids)
+        }
+        changed_items = []
+        new_items = []
+        for pair, availability in changes.items():
+            if pair in unknown_pairs:
+                continue
+            item = items.get(pair)
+            if item is None:
+                if availability:
+                    new_items.append(RestaurantMenuItem(
+                        restaurant_id=pair[0],
+                        product_id=pair[1],
+                        availability=True,
+                    ))
+            elif item.availability != availability:
+                item.availability = availability
+                changed_items.append(item)
+
+        self.bulk_update(changed_items, ['availability'])
+        self.bulk_create(new_items, ignore_conflicts=True)
+        return len(changed_items) + len(new_items), sorted(unknown_pairs)
+
+
 class RestaurantMenuItem(models.Model):
     restaurant = models.ForeignKey(
         Restaurant,
@@ -135,6 +205,7 @@ class RestaurantMenuItem(models.Model):
         default=True,
         db_index=True
     )
+    objects = RestaurantMenuItemQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'пункт меню ресторана'
@@ -147,12 +218,26 @@ class RestaurantMenuItem(models.Model):
         return f"{self.restaurant.name} - {self.product.name}"
 
 
+def elements_total_subquery():
+    totals = (
+        OrderElement.objects
+        .filter(order=OuterRef('pk'))
+        .values('order')
+        .annotate(total=Sum(F('price') * F('quantity')))
+        .values('total')
+    )
+    return Coalesce(Subquery(totals), Value(0),
+                    output_field=models.DecimalField(max_digits=10,
+                                                     decimal_places=2))
+
+
 class OrderQuerySet(models.QuerySet):
-    def count_total_sums(self):
-        orders_with_total_sums = self.annotate(
-            total=Sum(F('elements__price') * F('elements__quantity'))
-        )
-        return orders_with_total_sums
+    def with_calculated_totals(self):
+        return self.annotate(calculated_total=elements_total_subquery())
+
+    def recalculate_totals(self):
+        return self.update(total=elements_total_subquery(),
+                           updated_at=Now())
 
 
 class Order(models.Model):
@@ -217,11 +302,25 @@ class Order(models.Model):
                                      null=True, blank=True, db_index=True)
     delivered_at = models.DateTimeField(verbose_name='Доставлен в',
                                         null=True, blank=True, db_index=True)
+    updated_at = models.DateTimeField(verbose_name='Изменён в',
+                                      auto_now=True, db_index=True)
+    total = models.DecimalField(
+        'стоимость',
+        max_digits=10,
+        decimal_places=2,
+        default=0,
+        db_index=True,
+        editable=False,
+    )
     objects = OrderQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'заказ'
         verbose_name_plural = 'заказы'
+        indexes = [
+            models.Index(fields=['-status', 'id'],
+                         name='order_status_id_idx'),
+        ]
 
     def __str__(self):
         return f"Заказ № {self.id}"
@@ -231,6 +330,40 @@ class Order(models.Model):
     display_order.short_description = 'Заказ'
 
 
+class OrderElementQuerySet(models.QuerySet):
+    """Keeps Order.total in step with bulk writes and deletes.
+
+    Elements deleted together with their order are not touched, so the
+    cascade stays a single fast DELETE.
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        self._recalculate_totals({obj.order_id for obj in objs})
+        return objs
+
+    def bulk_update(self, objs, *args, **kwargs):
+        updated = super().bulk_update(objs, *args, **kwargs)
+        self._recalculate_totals({obj.order_id for obj in objs})
+        return updated
+
+    def update(self, **kwargs):
+        order_ids = set(self.values_list('order_id', flat=True))
+        updated = super().update(**kwargs)
+        self._recalculate_totals(order_ids)
+        return updated
+
+    def delete(self):
+        order_ids = set(self.values_list('order_id', flat=True))
+        deleted = super().delete()
+        self._recalculate_totals(order_ids)
+        return deleted
+
+    def _recalculate_totals(self, order_ids):
+        if order_ids:
+            Order.objects.filter(pk__in=order_ids).recalculate_totals()
+
+
 class OrderElement(models.Model):
     order = models.ForeignKey(
         Order,
@@ -259,9 +392,112 @@ class OrderElement(models.Model):
         ]
     )
 
+    objects = OrderElementQuerySet.as_manager()
+
+    # the admin turns this off and recalculates once for the whole order
+    recalculate_order_total = True
+
     class Meta:
         verbose_name = 'элемент заказа'
         verbose_name_plural = 'элементы заказа'
 
     def __str__(self):
         return f"{self.product.name}"
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        if self.recalculate_order_total:
+            Order.objects.filter(pk=self.order_id).recalculate_totals()
+
+    def delete(self, *args, **kwargs):
+        deleted = super().delete(*args, **kwargs)
+        if self.recalculate_order_total:
+            Order.objects.filter(pk=self.order_id).recalculate_totals()
+        return deleted
+
+
+class IdempotencyKeyQuerySet(models.QuerySet):
+    def expired(self, ttl):
+        return self.filter(created_at__lt=timezone.now() - ttl)
+
+
+class IdempotencyKey(models.Model):
+    KEY_MAX_LENGTH = 255
+
+    key = models.CharField(
+        'ключ',
+        max_length=KEY_MAX_LENGTH,
+        unique=True,
+    )
+    fingerprint = models.CharField(
+        'отпечаток запроса',
+        max_length=64,
+    )
+    response_status = models.PositiveSmallIntegerField('код ответа')
+    response_body = models.JSONField('ответ', encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(
+        'создан в',
+        default=timezone.now,
+        db_index=True,
+    )
+    objects = IdempotencyKeyQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'ключ идемпотентности'
+        verbose_name_plural = 'ключи идемпотентности'
+
+    def __str__(self):
+        return self.key
+
+    @staticmethod
+    def fingerprint_data(data):
+        dumped_data = json.dumps(data, sort_keys=True, ensure_ascii=False,
+                                 cls=DjangoJSONEncoder)
+        return hashlib.sha256(dumped_data.encode()).hexdigest()
+
+
+class Banner(models.Model):
+    title = models.CharField(
+        'заголовок',
+        max_length=50,
+    )
+    text = models.CharField(
+        'текст',
+        max_length=200,
+        blank=True,
+    )
+    image = models.ImageField(
+        'картинка',
+        upload_to='banners/',
+    )
+    position = models.PositiveSmallIntegerField(
+        'порядок',
+        default=0,
+    )
+    is_active = models.BooleanField(
+        'показывать',
+        default=True,
+    )
+    starts_at = models.DateTimeField(
+        'показывать с',
+        null=True,
+        blank=True,
+    )
+    ends_at = models.DateTimeField(
+        'показывать до',
+        null=True,
+        blank=True,
+    )
+
+    class Meta:
+        verbose_name = 'баннер'
+        verbose_name_plural = 'баннеры'
+        ordering = ['position', 'id']
+
+    def __str__(self):
+        return self.title
+
+    def is_shown_at(self, moment):
+        return (self.is_active
+                and (self.starts_at is None or self.starts_at <= moment)
+                and (self.ends_at is None or moment < self.ends_at))
@@ -0,0 +1,50 @@
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+json_encoder = DjangoJSONEncoder()
+
+
+def dumps(data, pretty=False):
+    """Encode data as UTF-8 JSON, compact unless pretty is asked for.
+
+    orjson is used if installed, with the same output as the json module
+    apart from the indentation of pretty JSON.
+    """
+    if orjson is not None:
+        option = orjson.OPT_PASSTHROUGH_DATETIME
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=json_encoder.default, option=option)
+    if pretty:
+        return json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False,
+                          indent=2).encode()
+    return json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False,
+                      separators=(',', ':')).encode()
+
+
+def wants_pretty(request):
+    return request.GET.get('pretty') in ['1', 'true']
+
+
+def json_response(request, data, status=200):
+    return HttpResponse(dumps(data, pretty=wants_pretty(request)),
+                        status=status, content_type='application/json')
+
+
+class ApiJSONRenderer(JSONRenderer):
+    """DRF renderer with the same JSON as the rest of the API."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        request = (renderer_context or {}).get('request')
+        return dumps(data, pretty=request is not None and wants_pretty(request))
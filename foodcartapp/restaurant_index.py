@@ -0,0 +1,69 @@
+import threading
+import time
+
+from django.core.cache import cache
+
+from locations.spatial import GridIndex
+from .models import Restaurant
+
+
+CELL_SIZE_KM = 5
+VERSION_KEY = 'restaurant_index_version'
+
+_lock = threading.Lock()
+_index = None
+_version = None
+
+
+def get_restaurant_index():
+    global _index, _version
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        _seed_version()
+        version = cache.get(VERSION_KEY)
+    with _lock:
+        if _index is None or _version != version:
+            index = GridIndex(cell_size_km=CELL_SIZE_KM)
+            restaurants = Restaurant.objects.values_list('id', 'lat', 'lon')
+            for restaurant_id, lat, lon in restaurants:
+                index.add(restaurant_id, lat, lon)
+            _index, _version = index, version
+        return _index
+
+
+def update_restaurant(restaurant):
+    _apply(lambda index: index.add(restaurant.id, restaurant.lat,
+                                   restaurant.lon))
+
+
+def discard_restaurant(restaurant_id):
+    _apply(lambda index: index.discard(restaurant_id))
+
+
+def invalidate_restaurant_index():
+    _apply(None)
+
+
+def _seed_version():
+    # a counter evicted from the cache restarts above any earlier value, so
+    # no process mistakes its old index for the current one
+    cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def _apply(change):
+    """Apply a change to this process's index and bump the shared version.
+
+    The version lives in the cache, which must be shared by all processes
+    (see CACHE_BACKEND). Other processes see the new version and rebuild
+    their index, this one updates in place if it was up to date before the
+    change.
+    """
+    global _index, _version
+    with _lock:
+        _seed_version()
+        version = cache.incr(VERSION_KEY)
+        if change and _index is not None and _version == version - 1:
+            change(_index)
+            _version = version
+        else:
+            _index = None
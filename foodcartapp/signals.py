@@ -0,0 +1,50 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .availability import invalidate_availability_matrix
+from .banners import invalidate_banners
+from .catalogue import invalidate_catalogue
+from .models import (
+    Banner, Product, ProductCategory, Restaurant, RestaurantMenuItem,
+)
+from .restaurant_index import discard_restaurant, update_restaurant
+
+
+@receiver(post_save, sender=Restaurant)
+def reindex_restaurant(sender, instance, **kwargs):
+    update_restaurant(instance)
+
+
+@receiver(post_delete, sender=Restaurant)
+def unindex_restaurant(sender, instance, **kwargs):
+    discard_restaurant(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductCategory)
+@receiver(post_delete, sender=ProductCategory)
+@receiver(post_save, sender=RestaurantMenuItem)
+@receiver(post_delete, sender=RestaurantMenuItem)
+def reset_catalogue(sender, **kwargs):
+    # before the commit a storefront request would cache the old rows again
+    transaction.on_commit(invalidate_catalogue)
+
+
+@receiver(post_save, sender=Banner)
+@receiver(post_delete, sender=Banner)
+def reset_banners(sender, **kwargs):
+    transaction.on_commit(invalidate_banners)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductCategory)
+@receiver(post_delete, sender=ProductCategory)
+@receiver(post_save, sender=Restaurant)
+@receiver(post_delete, sender=Restaurant)
+@receiver(post_save, sender=RestaurantMenuItem)
+@receiver(post_delete, sender=RestaurantMenuItem)
+def reset_availability_matrix(sender, **kwargs):
+    transaction.on_commit(invalidate_availability_matrix)
@@ -0,0 +1,132 @@
+import os
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+from time import perf_counter
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from locations.locator import geocoder
+from .models import (Order, OrderElement, Product, ProductCategory,
+                     Restaurant, RestaurantMenuItem)
+from .restaurant_index import invalidate_restaurant_index
+
+
+# Wall-clock budgets are too noisy for shared CI machines, so they are only
+# checked when BUDGET_TIME_FACTOR is set, e.g. to 1 on a quiet machine. The
+# query budgets, which are what catches an N+1, are always checked.
+BUDGET_TIME_FACTOR = float(os.getenv('BUDGET_TIME_FACTOR', 0))
+
+
+def seed_menu(products_count=300, restaurants_count=100, categories_count=10):
+    rng = random.Random(products_count * restaurants_count)
+    ProductCategory.objects.bulk_create(
+        ProductCategory(name=f'Категория {number}')
+        for number in range(categories_count)
+    )
+    categories = list(ProductCategory.objects.order_by('id'))
+    Product.objects.bulk_create(
+        Product(
+            name=f'Продукт {number}',
+            category=categories[number % categories_count],
+            price=100 + number,
+            image='burger.jpg',
+            special_status=number % 7 == 0,
+        )
+        for number in range(products_count)
+    )
+    Restaurant.objects.bulk_create(
+        Restaurant(
+            name=f'Star Burger {number}',
+            address=f'Москва, улица {number}',
+            contact_phone='+74951234567',
+            lat=55.5 + rng.random() / 2,
+            lon=37.3 + rng.random() / 2,
+        )
+        for number in range(restaurants_count)
+    )
+    products = list(Product.objects.order_by('id'))
+    restaurants = list(Restaurant.objects.order_by('id'))
+    RestaurantMenuItem.objects.bulk_create(
+        RestaurantMenuItem(restaurant=restaurant, product=product,
+                           availability=rng.random() < 0.9)
+        for restaurant in restaurants
+        for product in products
+    )
+    return products, restaurants
+
+
+def seed_orders(products, restaurants, count=10000, elements_per_order=3):
+    rng = random.Random(count)
+    now = timezone.now()
+    last_id = Order.objects.order_by('-id').values_list('id', flat=True).first()
+    Order.objects.bulk_create(
+        Order(
+            firstname='Иван',
+            lastname=f'Петров {number}',
+            phonenumber='+79123456789',
+            address=f'Москва, Тверская {number % 500}',
+            status=rng.choice([Order.UNPROCESSED, Order.COOKING,
+                               Order.PROCESSED]),
+            payment=rng.choice([Order.CASH, Order.EPAY]),
+            assigned_restaurant=(rng.choice(restaurants)
+                                 if number % 3 == 0 else None),
+            registered_at=now - timedelta(minutes=number),
+        )
+        for number in range(count)
+    )
+    orders = Order.objects.filter(id__gt=last_id or 0)
+    OrderElement.objects.bulk_create(
+        OrderElement(order_id=order_id, product=product,
+                     price=product.price, quantity=rng.randint(1, 3))
+        for order_id in orders.values_list('id', flat=True)
+        for product in rng.sample(products, elements_per_order)
+    )
+
+
+def create_manager():
+    return User.objects.create_superuser('manager', password='manager')
+
+
+class BudgetMixin:
+    """Asserts the number of SQL queries and the wall-clock time of a block."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        geocoder.clear()
+        invalidate_restaurant_index()
+
+    @contextmanager
+    def assertBudget(self, queries, seconds):
+        with CaptureQueriesContext(connection) as context:
+            started_at = perf_counter()
+            yield context
+            elapsed = perf_counter() - started_at
+        executed = [query['sql'] for query in context.captured_queries]
+        self.assertEqual(
+            len(executed), queries,
+            '%d queries executed, budget is %d:\n%s' % (
+                len(executed), queries, '\n'.join(executed),
+            ),
+        )
+        if BUDGET_TIME_FACTOR:
+            self.assertLessEqual(
+                elapsed, seconds * BUDGET_TIME_FACTOR,
+                f'took {elapsed:.3f}s, budget is {seconds}s',
+            )
+
+
+class SeededBudgetMixin(BudgetMixin):
+    """BudgetMixin on a database of 10 thousand orders and their menu."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.products, cls.restaurants = seed_menu()
+        seed_orders(cls.products, cls.restaurants)
+        cls.manager = create_manager()
@@ -0,0 +1,563 @@
+import gzip
+import json
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipIf
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import (AsyncRequestFactory, SimpleTestCase, TestCase,
+                         TransactionTestCase, override_settings)
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from locations.locator import geocoder
+from locations.addresses import address_key
+from locations.models import GeocodingJob, Location
+from star_burger.db import database_sync_to_async
+from . import async_views, renderers, restaurant_index
+from .checks import check_shared_cache
+from .dispatch import dispatch_orders
+from .management.commands.loadtest import LocalTarget
+from .models import (Banner, Order, OrderElement, Product, Restaurant,
+                     RestaurantMenuItem)
+from .testing import SeededBudgetMixin
+
+
+class RegisterOrderTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = [
+            Product.objects.create(name=f'Бургер {number}',
+                                   price=100 + number, image='burger.jpg')
+            for number in range(20)
+        ]
+
+    def post_order(self, products, address='Москва, Тверская 1', **headers):
+        return self.client.post(reverse('foodcartapp:register_order'), {
+            'firstname': 'Иван',
+            'lastname': 'Петров',
+            'phonenumber': '+79123456789',
+            'address': address,
+            'products': [{'product': product.id, 'quantity': 2}
+                         for product in products],
+        }, content_type='application/json', **headers)
+
+    def test_query_count_does_not_depend_on_cart_size(self):
+        with self.assertNumQueries(8):
+            response = self.post_order(self.products[:1])
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(8):
+            response = self.post_order(self.products)
+        self.assertEqual(response.status_code, 200)
+
+    def test_elements_copy_current_prices(self):
+        response = self.post_order(self.products[:3])
+        order = Order.objects.get()
+        self.assertEqual(response.json()['id'], order.id)
+        self.assertEqual(
+            list(order.elements.order_by('product_id')
+                               .values_list('price', flat=True)),
+            [product.price for product in self.products[:3]],
+        )
+
+    def test_order_total_follows_elements(self):
+        self.post_order(self.products[:3])
+        order = Order.objects.get()
+        self.assertEqual(order.total, 2 * sum(
+            product.price for product in self.products[:3]
+        ))
+        element = order.elements.first()
+        element.quantity += 1
+        element.save()
+        element.delete()
+        order.refresh_from_db()
+        self.assertEqual(order.total, sum(
+            element.price * element.quantity
+            for element in order.elements.all()
+        ))
+
+    def test_order_is_deleted_without_recalculating_its_total(self):
+        self.post_order(self.products[:10])
+        order = Order.objects.get()
+        with self.assertNumQueries(2):
+            order.delete()
+        self.assertFalse(OrderElement.objects.exists())
+
+    def test_admin_recalculates_total_once(self):
+        self.post_order(self.products[:3])
+        order = Order.objects.get()
+        elements = list(order.elements.order_by('id'))
+        data = {
+            'firstname': order.firstname,
+            'lastname': order.lastname,
+            'phonenumber': str(order.phonenumber),
+            'address': order.address,
+            'status': order.status,
+            'payment': Order.CASH,
+            'comment': '',
+            'registered_at_0': order.registered_at.strftime('%Y-%m-%d'),
+            'registered_at_1': order.registered_at.strftime('%H:%M:%S'),
+            'elements-TOTAL_FORMS': len(elements),
+            'elements-INITIAL_FORMS': len(elements),
+            'elements-MIN_NUM_FORMS': 0,
+            'elements-MAX_NUM_FORMS': 1000,
+        }
+        for number, element in enumerate(elements):
+            data.update({
+                f'elements-{number}-id': element.id,
+                f'elements-{number}-order': order.id,
+                f'elements-{number}-product': element.product_id,
+                f'elements-{number}-price': element.price,
+                f'elements-{number}-quantity': 5,
+            })
+        data['elements-0-DELETE'] = 'on'
+        self.client.force_login(User.objects.create_superuser('admin'))
+        url = reverse('admin:foodcartapp_order_change', args=[order.id])
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        recalculations = [
+            query for query in context.captured_queries
+            if query['sql'].startswith('UPDATE "foodcartapp_order" SET '
+                                       '"total"')
+        ]
+        self.assertEqual(len(recalculations), 1)
+        order.refresh_from_db()
+        self.assertEqual(order.total, 5 * sum(
+            element.price for element in elements[1:]
+        ))
+
+    def test_unknown_product_is_rejected(self):
+        missing = Product(id=999)
+        response = self.post_order([self.products[0], missing])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('products', response.json())
+        self.assertFalse(OrderElement.objects.exists())
+
+    def test_retry_with_idempotency_key_replays_response(self):
+        first = self.post_order(self.products[:2], HTTP_IDEMPOTENCY_KEY='abc')
+        with self.assertNumQueries(1):
+            retry = self.post_order(self.products[:2],
+                                    HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_idempotency_key_reuse_with_other_payload_is_rejected(self):
+        self.post_order(self.products[:2], HTTP_IDEMPOTENCY_KEY='abc')
+        response = self.post_order(self.products[:2], address='Казань',
+                                   HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+
+class RegisterOrdersBatchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.burger = Product.objects.create(name='Бургер', price=300,
+                                            image='burger.jpg')
+        cls.fries = Product.objects.create(name='Картошка', price=100,
+                                           image='fries.jpg')
+
+    def order_data(self, products, address='Москва, Тверская 1'):
+        return {
+            'firstname': 'Иван',
+            'lastname': 'Петров',
+            'phonenumber': '+79123456789',
+            'address': address,
+            'products': [{'product': product.id, 'quantity': 1}
+                         for product in products],
+        }
+
+    def post_batch(self, orders_data):
+        return self.client.post(reverse('foodcartapp:register_orders_batch'),
+                                orders_data, content_type='application/json')
+
+    def test_creates_all_orders_with_elements(self):
+        response = self.post_batch([
+            self.order_data([self.burger, self.fries]),
+            self.order_data([self.fries], address='Казань'),
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 2)
+        self.assertEqual(Order.objects.count(), 2)
+        self.assertEqual(OrderElement.objects.count(), 3)
+
+    def test_reports_errors_per_order_and_creates_nothing(self):
+        invalid_order = self.order_data([self.burger])
+        invalid_order['products'] = []
+        response = self.post_batch([self.order_data([self.burger]),
+                                    invalid_order])
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()['errors']
+        self.assertEqual([error['index'] for error in errors], [1])
+        self.assertIn('products', errors[0]['errors'])
+        self.assertFalse(Order.objects.exists())
+
+
+class BannersTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Banner.objects.all().delete()
+        now = timezone.now()
+        Banner.objects.bulk_create([
+            Banner(title='Второй', image='banners/second.jpg', position=2),
+            Banner(title='Первый', image='banners/first.jpg', position=1),
+            Banner(title='Скрытый', image='banners/hidden.jpg',
+                   is_active=False),
+            Banner(title='Прошедший', image='banners/past.jpg',
+                   ends_at=now - timedelta(days=1)),
+            Banner(title='Будущий', image='banners/future.jpg',
+                   starts_at=now + timedelta(days=1)),
+        ])
+
+    def setUp(self):
+        cache.clear()
+
+    def get_banners(self, **headers):
+        return self.client.get(reverse('foodcartapp:banners_list_api'),
+                               **headers)
+
+    def test_only_scheduled_banners_are_shown_in_order(self):
+        response = self.get_banners()
+        self.assertEqual([banner['title'] for banner in response.json()],
+                         ['Первый', 'Второй'])
+        self.assertEqual(response.json()[0]['src'],
+                         '/media/banners/first.jpg')
+
+    def test_response_is_cached_until_banners_change(self):
+        with self.assertNumQueries(1):
+            first = self.get_banners()
+        with self.assertNumQueries(0):
+            unchanged = self.get_banners(HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(unchanged.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Banner.objects.filter(title='Второй').get().delete()
+            # the cache is only reset once the change is committed
+            before_commit = self.get_banners(
+                HTTP_IF_NONE_MATCH=first['ETag'],
+            )
+        self.assertEqual(before_commit.status_code, 304)
+        changed = self.get_banners(HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(len(changed.json()), 1)
+
+    def test_cache_expires_when_a_banner_is_due(self):
+        Banner.objects.create(title='Скоро', image='banners/soon.jpg',
+                              starts_at=timezone.now() + timedelta(minutes=10))
+        with mock.patch.object(cache, 'set') as cache_set:
+            self.get_banners()
+        self.assertAlmostEqual(cache_set.call_args.kwargs['timeout'], 10 * 60,
+                               delta=5)
+
+
+class JSONRenderingTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        restaurant = Restaurant.objects.create(name='Рядом')
+        for number in range(20):
+            product = Product.objects.create(name=f'Бургер {number}',
+                                             price='100.50',
+                                             image='burger.jpg')
+            RestaurantMenuItem.objects.create(restaurant=restaurant,
+                                              product=product)
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('foodcartapp:product_list_api')
+
+    def test_compact_by_default_and_pretty_on_request(self):
+        compact = self.client.get(self.url)
+        self.assertNotIn(b'\n', compact.content)
+        self.assertNotIn(b', ', compact.content)
+        pretty = self.client.get(self.url, {'pretty': 1})
+        self.assertIn(b'\n  ', pretty.content)
+        self.assertEqual(pretty.json(), compact.json())
+        self.assertEqual(pretty['ETag'], f'W/{compact["ETag"]}')
+
+    def test_compressed_catalogue_is_negotiated(self):
+        plain = self.client.get(self.url)
+        self.assertNotIn('Content-Encoding', plain)
+        compressed = self.client.get(self.url,
+                                     HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', compressed['Vary'])
+        self.assertEqual(gzip.decompress(compressed.content), plain.content)
+        refused = self.client.get(self.url,
+                                  HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertNotIn('Content-Encoding', refused)
+
+    def test_order_api_uses_the_same_json(self):
+        url = reverse('foodcartapp:register_order')
+        compact = self.client.post(url, {}, content_type='application/json')
+        self.assertEqual(compact.status_code, 400)
+        self.assertNotIn(b'\n', compact.content)
+        self.assertIn('Обязательное поле'.encode(), compact.content)
+        pretty = self.client.post(f'{url}?pretty=1', {},
+                                  content_type='application/json')
+        self.assertIn(b'\n  ', pretty.content)
+
+    @skipIf(renderers.orjson is None, 'orjson is not installed')
+    def test_json_module_gives_the_same_output(self):
+        data = {'price': Decimal('100.50'), 'name': 'Бургер',
+                'registered_at': timezone.now(), 'items': [1, None, True]}
+        fast = renderers.dumps(data)
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assertEqual(renderers.dumps(data), fast)
+
+
+class RestaurantIndexTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        restaurant_index.invalidate_restaurant_index()
+        self.near = Restaurant.objects.create(name='Рядом', lat=55.76,
+                                              lon=37.61)
+
+    def test_change_made_by_another_process_is_picked_up(self):
+        self.assertIn(self.near.id, restaurant_index.get_restaurant_index())
+        # another process saves a restaurant without touching our index
+        with mock.patch.object(restaurant_index, '_index', None):
+            farther = Restaurant.objects.create(name='Подальше', lat=55.78,
+                                                lon=37.61)
+        self.assertIn(farther.id, restaurant_index.get_restaurant_index())
+
+    def test_index_is_rebuilt_after_the_version_is_evicted(self):
+        index = restaurant_index.get_restaurant_index()
+        cache.delete(restaurant_index.VERSION_KEY)
+        self.assertIsNot(restaurant_index.get_restaurant_index(), index)
+
+
+class SharedCacheCheckTest(SimpleTestCase):
+    def test_process_local_cache_is_reported(self):
+        for backend, warnings in [('locmem.LocMemCache', ['foodcartapp.W001']),
+                                  ('db.DatabaseCache', [])]:
+            caches = {'default': {
+                'BACKEND': f'django.core.cache.backends.{backend}',
+                'LOCATION': 'cache',
+            }}
+            with self.subTest(backend=backend), \
+                    override_settings(CACHES=caches):
+                self.assertEqual([warning.id for warning
+                                  in check_shared_cache(None)], warnings)
+
+
+class BudgetTest(SeededBudgetMixin, TestCase):
+    def test_product_list(self):
+        url = reverse('foodcartapp:product_list_api')
+        with self.assertBudget(queries=1, seconds=0.5):
+            response = self.client.get(url)
+        self.assertEqual(len(response.json()), len(self.products))
+        with self.assertBudget(queries=0, seconds=0.05):
+            self.client.get(url)
+
+    def test_register_order(self):
+        with self.assertBudget(queries=8, seconds=0.2):
+            response = self.client.post(
+                reverse('foodcartapp:register_order'),
+                {
+                    'firstname': 'Иван',
+                    'lastname': 'Петров',
+                    'phonenumber': '+79123456789',
+                    'address': 'Москва, Тверская 1',
+                    'products': [{'product': product.id, 'quantity': 1}
+                                 for product in self.products[:50]],
+                },
+                content_type='application/json',
+            )
+        self.assertEqual(response.status_code, 200)
+
+    def test_admin_changelists(self):
+        self.client.force_login(self.manager)
+        for model, queries in [('order', 5), ('product', 6),
+                               ('restaurant', 5), ('productcategory', 5)]:
+            url = reverse(f'admin:foodcartapp_{model}_changelist')
+            with self.subTest(model=model):
+                with self.assertBudget(queries=queries, seconds=1):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+    def test_admin_order_change_page(self):
+        self.client.force_login(self.manager)
+        order = Order.objects.first()
+        url = reverse('admin:foodcartapp_order_change', args=[order.id])
+        with self.assertBudget(queries=10, seconds=1):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+
+class DispatchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.burger = Product.objects.create(name='Бургер', price=300,
+                                            image='burger.jpg')
+        cls.fries = Product.objects.create(name='Картошка', price=100,
+                                           image='fries.jpg')
+        cls.near = Restaurant.objects.create(name='Рядом', lat=55.76,
+                                             lon=37.61)
+        cls.farther = Restaurant.objects.create(name='Подальше', lat=55.78,
+                                                lon=37.61)
+        cls.burgers_only = Restaurant.objects.create(name='Бургерная',
+                                                     lat=55.75, lon=37.61)
+        RestaurantMenuItem.objects.bulk_create([
+            RestaurantMenuItem(restaurant=restaurant, product=product)
+            for restaurant in [cls.near, cls.farther]
+            for product in [cls.burger, cls.fries]
+        ] + [RestaurantMenuItem(restaurant=cls.burgers_only,
+                                product=cls.burger)])
+        Location.objects.create(address='Москва, Тверская 1',
+                                lat=55.75, lon=37.61)
+
+    def setUp(self):
+        geocoder.clear()
+
+    def create_order(self, address='Москва, Тверская 1', **fields):
+        order = Order.objects.create(firstname='Иван', lastname='Петров',
+                                     phonenumber='+79123456789',
+                                     address=address, **fields)
+        OrderElement.objects.bulk_create([
+            OrderElement(order=order, product=product, price=product.price,
+                         quantity=1)
+            for product in [self.burger, self.fries]
+        ])
+        return order
+
+    def test_nearest_restaurant_with_whole_menu_is_assigned(self):
+        order = self.create_order()
+        self.assertEqual(dispatch_orders(), {order.id: self.near.id})
+        order.refresh_from_db()
+        self.assertEqual(order.assigned_restaurant, self.near)
+
+    @override_settings(DISPATCH_LOAD_PENALTY_KM=2)
+    def test_busy_kitchen_hands_orders_to_neighbours(self):
+        for _ in range(2):
+            self.create_order(status=Order.COOKING,
+                              assigned_restaurant=self.near)
+        order = self.create_order()
+        self.assertEqual(dispatch_orders(), {order.id: self.farther.id})
+
+    def test_orders_without_coordinates_wait(self):
+        self.create_order(address='Казань, Баумана 1')
+        self.assertEqual(dispatch_orders(), {})
+
+    def test_query_count_does_not_depend_on_order_count(self):
+        self.create_order()
+        with self.assertNumQueries(7):
+            dispatch_orders()
+        for _ in range(20):
+            self.create_order()
+        geocoder.clear()
+        with self.assertNumQueries(7):
+            self.assertEqual(len(dispatch_orders()), 20)
+
+    @override_settings(DISPATCH_ON_CREATE=True)
+    def test_new_orders_are_dispatched_by_the_worker(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('foodcartapp:register_order'),
+                {
+                    'firstname': 'Иван',
+                    'lastname': 'Петров',
+                    'phonenumber': '+79123456789',
+                    'address': 'Москва, Тверская 1',
+                    'products': [{'product': self.burger.id, 'quantity': 1}],
+                },
+                content_type='application/json',
+            )
+        order = Order.objects.get(pk=response.json()['id'])
+        self.assertIsNone(order.assigned_restaurant)
+
+        call_command('geocode_worker', once=True)
+
+        order.refresh_from_db()
+        self.assertEqual(order.assigned_restaurant, self.burgers_only)
+
+
+class LoadTestCommandTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.burger = Product.objects.create(name='Бургер', price=300,
+                                            image='burger.jpg')
+        restaurant = Restaurant.objects.create(name='Рядом')
+        RestaurantMenuItem.objects.create(restaurant=restaurant,
+                                          product=cls.burger)
+
+    def order(self, address):
+        return {
+            'firstname': 'Иван',
+            'lastname': 'Нагрузочный',
+            'phonenumber': '+79123456789',
+            'address': address,
+            'products': [{'product': self.burger.id, 'quantity': 1}],
+        }
+
+    def test_refuses_local_database_without_debug(self):
+        with self.assertRaisesMessage(CommandError, '--allow-local-db'):
+            call_command('loadtest', requests=1)
+        self.assertFalse(Order.objects.exists())
+
+    def test_rejects_non_positive_rps(self):
+        with self.assertRaisesMessage(CommandError, '--rps'):
+            call_command('loadtest', requests=1, rps=0, allow_local_db=True)
+
+    def test_cleanup_removes_geocoding_of_its_orders(self):
+        Location.objects.create(address='Москва, Тверская улица, 1',
+                                lat=55.76, lon=37.61)
+        addresses = ['Москва, Тверская улица, 1', 'Москва, Новый Арбат, 15']
+        target = LocalTarget('localhost', addresses)
+        for address in addresses:
+            status, _ = target.request('order', self.order(address))
+            self.assertEqual(status, 200)
+        Location.objects.create(address='Москва, Новый Арбат, 15')
+
+        target.cleanup()
+
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(GeocodingJob.objects.exists())
+        self.assertEqual(
+            list(Location.objects.values_list('key', flat=True)),
+            [address_key('Москва, Тверская улица, 1')],
+        )
+
+
+class AsyncViewsTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.burger = Product.objects.create(name='Бургер', price=300,
+                                             image='burger.jpg')
+        self.factory = AsyncRequestFactory()
+
+    async def test_product_list_matches_sync_view(self):
+        request = self.factory.get('/api/products/')
+        response = await async_views.product_list_api(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content),
+                         self.client.get(reverse('foodcartapp:product_list_api'))
+                                    .json())
+
+    async def test_register_order(self):
+        request = self.factory.post('/api/order/', {
+            'firstname': 'Иван',
+            'lastname': 'Петров',
+            'phonenumber': '+79123456789',
+            'address': 'Москва, Тверская 1',
+            'products': [{'product': self.burger.id, 'quantity': 2}],
+        }, content_type='application/json', **{'Idempotency-Key': 'abc'})
+        response = await async_views.register_order(request)
+        self.assertEqual(response.status_code, 200)
+        retry = await async_views.register_order(request)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        order = await database_sync_to_async(Order.objects.get)()
+        self.assertEqual(json.loads(response.content)['id'], order.id)
+
+    async def test_invalid_order_is_rejected(self):
+        request = self.factory.post('/api/order/', {'products': []},
+                                    content_type='application/json')
+        response = await async_views.register_order(request)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('products', json.loads(response.content))
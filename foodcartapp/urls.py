@@ -1,12 +1,22 @@
+from django.conf import settings
 from django.urls import path
 
-from .views import product_list_api, banners_list_api, register_order
+from .views import (
+    product_list_api, banners_list_api, register_order, register_orders_batch,
+)
+
+if settings.ASYNC_API:
+    from .async_views import (  # noqa: F811
+        product_list_api, banners_list_api, register_order,
+    )
 
 
 app_name = "foodcartapp"
 
 urlpatterns = [
-    path('products/', product_list_api),
-    path('banners/', banners_list_api),
-    path('order/', register_order),
+    path('products/', product_list_api, name='product_list_api'),
+    path('banners/', banners_list_api, name='banners_list_api'),
+    path('order/', register_order, name='register_order'),
+    path('orders/batch/', register_orders_batch,
+         name='register_orders_batch'),
 ]
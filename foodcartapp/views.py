@@ -1,71 +1,33 @@
 import requests
 
-from django.http import JsonResponse
-from django.templatetags.static import static
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.serializers import ModelSerializer
-from django.db import transaction
+from rest_framework.serializers import (
+    IntegerField, ModelSerializer, ValidationError,
+)
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
 
-from .models import Product, Order, OrderElement
-from locations.models import Location
-from locations.locator import fetch_coordinates
+from .banners import get_banners
+from .caching import payload_response
+from .catalogue import get_catalogue
+from .models import IdempotencyKey, Product, Order, OrderElement
+from locations.models import GeocodingJob
 
 
 def banners_list_api(request):
-    # FIXME move data to db?
-    return JsonResponse([
-        {
-            'title': 'Burger',
-            'src': static('burger.jpg'),
-            'text': 'Tasty Burger at your door step',
-        },  
-        {
-            'title': 'Spices',
-            'src': static('food.jpg'),
-            'text': 'All Cuisines',
-        },
-        {
-            'title': 'New York',
-            'src': static('tasty.jpg'),
-            'text': 'Food is incomplete without a tasty dessert',
-        }
-    ], safe=False, json_dumps_params={
-        'ensure_ascii': False,
-        'indent': 4,
-    })
+    return payload_response(request, get_banners())
 
 
 def product_list_api(request):
-    products = Product.objects.select_related('category').available()
-    dumped_products = []
-    for product in products:
-        dumped_product = {
-            'id': product.id,
-            'name': product.name,
-            'price': product.price,
-            'special_status': product.special_status,
-            'description': product.description,
-            'category': {
-                'id': product.category.id,
-                'name': product.category.name,
-            } if product.category else None,
-            'image': product.image.url,
-            'restaurant': {
-                'id': product.id,
-                'name': product.name,
-            }
-        }
-        dumped_products.append(dumped_product)
-    return JsonResponse(dumped_products, safe=False, json_dumps_params={
-        'ensure_ascii': False,
-        'indent': 4,
-    })
+    return payload_response(request, get_catalogue())
 
 
 class OrderElementSerializer(ModelSerializer):
+    product = IntegerField()
+
     class Meta:
         model = OrderElement
         fields = ['product', 'quantity']
@@ -81,11 +43,32 @@ class OrderSerializer(ModelSerializer):
             'firstname', 'lastname', 'phonenumber', 'address', 'products'
         ]
 
+    def validate_products(self, elements):
+        products = self.context.setdefault('products', {})
+        product_ids = {element['product'] for element in elements}
+        missing_ids = product_ids - products.keys()
+        if missing_ids:
+            products.update(Product.objects.in_bulk(missing_ids))
+        unknown_ids = sorted(product_ids - products.keys())
+        if unknown_ids:
+            raise ValidationError(
+                f'Недопустимый первичный ключ "{unknown_ids[0]}" - '
+                'объект не существует.'
+            )
+        return [{**element, 'product': products[element['product']]}
+                for element in elements]
+
+
+def price_order_elements(order, elements):
+    return [
+        OrderElement(order=order, price=element['product'].price, **element)
+        for element in elements
+    ]
+
 
-@api_view(['POST'])
 @transaction.atomic
-def register_order(request):
-    serializer = OrderSerializer(data=request.data)
+def create_order(data):
+    serializer = OrderSerializer(data=data)
     serializer.is_valid(raise_exception=True)
     created_order = Order.objects.create(
         firstname=serializer.validated_data['firstname'],
@@ -93,18 +76,125 @@ def register_order(request):
         phonenumber=serializer.validated_data['phonenumber'],
         address=serializer.validated_data['address'],
     )
-    location, created = Location.objects.get_or_create(
-        address=created_order.address,
+    GeocodingJob.objects.enqueue([created_order.address])
+    OrderElement.objects.bulk_create(price_order_elements(
+        created_order,
+        serializer.validated_data['products'],
+    ))
+    return {'id': created_order.id, **serializer.data}
+
+
+def register_order_data(data, key=None):
+    """Create an order once per Idempotency-Key.
+
+    Returns response data, status and headers; invalid orders raise
+    ValidationError.
+    """
+    if key is None:
+        return create_order(data), status.HTTP_200_OK, {}
+    if not 0 < len(key) <= IdempotencyKey.KEY_MAX_LENGTH:
+        return (
+            {'detail': 'Недопустимый ключ идемпотентности.'},
+            status.HTTP_400_BAD_REQUEST,
+            {},
+        )
+
+    fingerprint = IdempotencyKey.fingerprint_data(data)
+    stored = IdempotencyKey.objects.filter(key=key).first()
+    if stored is None:
+        try:
+            with transaction.atomic():
+                response_data = create_order(data)
+                IdempotencyKey.objects.create(
+                    key=key,
+                    fingerprint=fingerprint,
+                    response_status=status.HTTP_200_OK,
+                    response_body=response_data,
+                )
+            return response_data, status.HTTP_200_OK, {}
+        except IntegrityError:
+            stored = IdempotencyKey.objects.filter(key=key).first()
+            if stored is None:
+                raise
+
+    if stored.fingerprint != fingerprint:
+        return (
+            {'detail': 'Ключ идемпотентности уже использован '
+                       'с другим запросом.'},
+            status.HTTP_422_UNPROCESSABLE_ENTITY,
+            {},
+        )
+    return (stored.response_body, stored.response_status,
+            {'Idempotent-Replayed': 'true'})
+
+
+@api_view(['POST'])
+def register_order(request):
+    data, status_code, headers = register_order_data(
+        request.data, request.headers.get('Idempotency-Key'),
+    )
+    return Response(data, status=status_code, headers=headers)
+
+
+def collect_product_ids(orders_data):
+    product_ids = set()
+    for order_data in orders_data:
+        if not isinstance(order_data, dict):
+            continue
+        elements = order_data.get('products')
+        if not isinstance(elements, list):
+            continue
+        for element in elements:
+            if isinstance(element, dict) and \
+                    str(element.get('product')).isdigit():
+                product_ids.add(int(element['product']))
+    return product_ids
+
+
+@api_view(['POST'])
+@transaction.atomic
+def register_orders_batch(request):
+    if not isinstance(request.data, list):
+        return Response({'detail': 'Ожидается список заказов.'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    if len(request.data) > settings.ORDERS_BATCH_MAX_SIZE:
+        return Response(
+            {'detail': 'Не больше {} заказов за раз.'.format(
+                settings.ORDERS_BATCH_MAX_SIZE
+            )},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    products = Product.objects.in_bulk(collect_product_ids(request.data))
+    serializer = OrderSerializer(data=request.data, many=True,
+                                 context={'products': products})
+    if not serializer.is_valid():
+        return Response({'errors': [
+            {'index': index, 'errors': errors}
+            for index, errors in enumerate(serializer.errors) if errors
+        ]}, status=status.HTTP_400_BAD_REQUEST)
+
+    orders = [
+        Order(
+            firstname=order_data['firstname'],
+            lastname=order_data['lastname'],
+            phonenumber=order_data['phonenumber'],
+            address=order_data['address'],
+        ) for order_data in serializer.validated_data
+    ]
+    if connection.features.can_return_rows_from_bulk_insert:
+        Order.objects.bulk_create(orders)
+    else:
+        for order in orders:
+            order.save()
+    GeocodingJob.objects.enqueue({order.address for order in orders})
+    OrderElement.objects.bulk_create([
+        element
+        for order, order_data in zip(orders, serializer.validated_data)
+        for element in price_order_elements(order, order_data['products'])
+    ])
+    return Response(
+        [{'id': order.id, **order_data}
+         for order, order_data in zip(orders, serializer.data)],
+        status=status.HTTP_200_OK,
     )
-    if created:
-        coords = fetch_coordinates(location.address)
-        location.lat, location.lon = coords if coords else None, None
-        location.save()
-
-    products_fields = serializer.validated_data['products']
-    order_elements = [OrderElement(order=created_order,
-                      price=Product.objects.get(pk=fields['product'].id).price,
-                      **fields)
-                      for fields in products_fields]
-    OrderElement.objects.bulk_create(order_elements)
-    return Response(serializer.data, status=status.HTTP_200_OK)
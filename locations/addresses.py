@@ -0,0 +1,50 @@
+import re
+
+
+ABBREVIATIONS = {
+    'ул': 'улица',
+    'пр': 'проспект',
+    'пр-т': 'проспект',
+    'пр-кт': 'проспект',
+    'просп': 'проспект',
+    'пер': 'переулок',
+    'пл': 'площадь',
+    'б-р': 'бульвар',
+    'бул': 'бульвар',
+    'ш': 'шоссе',
+    'наб': 'набережная',
+    'туп': 'тупик',
+    'мкр': 'микрорайон',
+    'мкрн': 'микрорайон',
+    'обл': 'область',
+    'пос': 'поселок',
+    'к': 'корпус',
+    'корп': 'корпус',
+    'стр': 'строение',
+}
+STREET_TYPES = {'улица', 'проспект', 'переулок', 'площадь', 'бульвар', 'шоссе',
+                'набережная', 'тупик', 'проезд'}
+# Words that are often left out and so must not tell addresses apart
+OPTIONAL_WORDS = {'г', 'город', 'д', 'дом'}
+
+WORD_RE = re.compile(r'\w+(?:-\w+)*')
+
+
+def normalize_address(address):
+    return ' '.join(address.split())
+
+
+def address_key(address):
+    """Reduce an address to a key equal for spellings of the same place.
+
+    Case, "ё", punctuation, common abbreviations and the position of the
+    street type are ignored, so "г. Москва, ул. Тверская, д. 1" and
+    "москва тверская улица 1" share a key.
+    """
+    words = WORD_RE.findall(address.casefold().replace('ё', 'е'))
+    words = [ABBREVIATIONS.get(word, word) for word in words
+             if word not in OPTIONAL_WORDS]
+    for index in range(len(words) - 1):
+        if words[index] in STREET_TYPES and not words[index + 1].isdigit():
+            words[index], words[index + 1] = words[index + 1], words[index]
+    return ' '.join(words)
@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Location
+from .models import Location, GeocodingJob
 
 
 @admin.register(Location)
@@ -9,4 +9,20 @@ class LocationAdmin(admin.ModelAdmin):
         'address',
         'lat',
         'lon',
-    ]
\ No newline at end of file
+    ]
+
+
+@admin.register(GeocodingJob)
+class GeocodingJobAdmin(admin.ModelAdmin):
+    list_display = [
+        'address',
+        'status',
+        'attempts',
+        'run_after',
+    ]
+    list_filter = [
+        'status',
+    ]
+    search_fields = [
+        'address',
+    ]
@@ -0,0 +1,26 @@
+import numpy as np
+
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def as_coords_array(coords):
+    """Stack (lat, lon) pairs into an array, using NaN for missing pairs."""
+    return np.array(
+        [pair if pair else (np.nan, np.nan) for pair in coords],
+        dtype=float,
+    ).reshape(-1, 2)
+
+
+def distance_matrix(origins, destinations):
+    """Haversine distances in km between every origin and destination."""
+    origins = np.radians(as_coords_array(origins))
+    destinations = np.radians(as_coords_array(destinations))
+    lat1, lon1 = origins[:, 0, np.newaxis], origins[:, 1, np.newaxis]
+    lat2, lon2 = destinations[np.newaxis, :, 0], destinations[np.newaxis, :, 1]
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
@@ -0,0 +1,82 @@
+import hashlib
+import json
+import random
+import threading
+import time
+from urllib.parse import parse_qs
+
+from django.conf import settings
+
+from .locator import GeocoderError
+
+
+# Coordinates are spread over this (south-west, north-east) box
+BOUNDS = ((55.55, 37.35), (55.95, 37.85))
+
+
+def fake_coordinates(address, not_found_rate=0):
+    """Coordinates derived from the address alone, or None if "not found"."""
+    digest = hashlib.sha256(address.encode('utf-8')).digest()
+    shares = [int.from_bytes(digest[start:start + 4], 'big') / 2 ** 32
+              for start in (0, 4, 8)]
+    if shares[0] < not_found_rate:
+        return None
+    (south, west), (north, east) = BOUNDS
+    return (round(south + (north - south) * shares[1], 6),
+            round(west + (east - west) * shares[2], 6))
+
+
+class FakeGeocoder:
+    """Stand-in for the Yandex geocoder with a configurable latency and
+    failure rate.
+
+    It is a geocoder backend itself and, through wsgi_app, an HTTP server
+    speaking the Yandex response format for GEOCODER_URL to point at.
+    """
+
+    def __init__(self, latency=0, error_rate=0, not_found_rate=0, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.not_found_rate = not_found_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def __call__(self, address, session=None):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            failed = self._random.random() < self.error_rate
+        if failed:
+            raise GeocoderError('Fake geocoder failure')
+        return fake_coordinates(address, self.not_found_rate)
+
+    def wsgi_app(self, environ, start_response):
+        params = parse_qs(environ.get('QUERY_STRING', ''))
+        address = params.get('geocode', [''])[0]
+        try:
+            coords = self(address)
+        except GeocoderError as err:
+            status = '503 Service Unavailable'
+            body = {'statusCode': 503, 'message': str(err)}
+        else:
+            status = '200 OK'
+            places = []
+            if coords:
+                lat, lon = coords
+                places.append({'GeoObject': {'Point': {'pos': f'{lon} {lat}'}}})
+            body = {'response': {'GeoObjectCollection': {
+                'featureMember': places,
+            }}}
+        content = json.dumps(body).encode('utf-8')
+        start_response(status, [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(content))),
+        ])
+        return [content]
+
+
+fake_geocoder = FakeGeocoder(
+    latency=settings.GEOCODER_FAKE_LATENCY_MS / 1000,
+    error_rate=settings.GEOCODER_FAKE_ERROR_RATE,
+    not_found_rate=settings.GEOCODER_FAKE_NOT_FOUND_RATE,
+)
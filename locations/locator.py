@@ -1,33 +1,298 @@
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future
+
 import requests
 from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from star_burger.metrics import registry, track_geocoder_call
+from .addresses import address_key, normalize_address
+from .models import Location
+from .throttling import CircuitBreaker
+
+
+logger = logging.getLogger(__name__)
+
+CacheEntry = namedtuple('CacheEntry', ['coords', 'updated_at'])
+
+
+class GeocoderError(Exception):
+    pass
+
+
+class GeocoderUnavailable(GeocoderError):
+    """Raised without calling the geocoder while its circuit is open."""
+
+
+TRANSIENT_STATUSES = {429, 500, 502, 503, 504}
+
+
+def build_session():
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_maxsize=settings.GEOCODER_POOL_SIZE,
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
 
+http_session = build_session()
+breaker = CircuitBreaker(
+    failure_threshold=settings.GEOCODER_BREAKER_THRESHOLD,
+    reset_timeout=settings.GEOCODER_BREAKER_RESET_SECONDS,
+)
+registry.describe('starburger_geocoder_rejected_total', 'counter',
+                  'Запросы к геокодеру, отклонённые предохранителем')
+registry.gauge('starburger_geocoder_circuit_open',
+               'Отключён ли геокодер предохранителем',
+               lambda: int(breaker.state != CircuitBreaker.CLOSED))
 
-def fetch_coordinates(address, apikey=settings.GEOCODER_TOKEN):
-    base_url = "https://geocode-maps.yandex.ru/1.x"
+
+def request_params(address, apikey):
+    return {
+        "geocode": address,
+        "apikey": apikey,
+        "format": "json",
+    }
+
+
+def retry_delay(attempt):
+    return random.uniform(0, settings.GEOCODER_RETRY_BACKOFF * 2 ** attempt)
+
+
+def request_places(address, apikey, session):
+    """Query the geocoder, retrying timeouts and 5xx answers with jitter."""
+    retries = settings.GEOCODER_RETRIES
+    for attempt in range(retries + 1):
+        try:
+            response = session.get(
+                settings.GEOCODER_URL,
+                params=request_params(address, apikey),
+                timeout=(settings.GEOCODER_CONNECT_TIMEOUT,
+                         settings.GEOCODER_READ_TIMEOUT),
+            )
+            response.raise_for_status()
+            return response.json()['response']['GeoObjectCollection']['featureMember']
+        except (requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+                requests.exceptions.HTTPError) as err:
+            transient = (err.response is None
+                         or err.response.status_code in TRANSIENT_STATUSES)
+            if not transient or attempt == retries:
+                raise GeocoderError(err) from err
+        except (requests.exceptions.RequestException, KeyError,
+                ValueError) as err:
+            raise GeocoderError(err) from err
+        time.sleep(retry_delay(attempt))
+
+
+def check_breaker():
+    if not breaker.allow():
+        registry.inc('starburger_geocoder_rejected_total')
+        raise GeocoderUnavailable(
+            f'Geocoder is unavailable for {breaker.retry_after():.0f}s'
+        )
+
+
+def parse_coordinates(found_places):
+    if 'error' in found_places:
+        raise GeocoderError(found_places['error'])
+    if not found_places:
+        return None
+    most_relevant = found_places[0]
+    lon, lat = most_relevant['GeoObject']['Point']['pos'].split(" ")
+    return float(lat), float(lon)
+
+
+def request_coordinates(address, apikey=settings.GEOCODER_TOKEN,
+                        session=None):
+    check_breaker()
     try:
-        response = requests.get(base_url, params={
-            "geocode": address,
-            "apikey": apikey,
-            "format": "json",
-        })
-        response.raise_for_status()
-        found_places = response.json()['response']['GeoObjectCollection']['featureMember']
-        if 'error' in found_places:
-            raise requests.exceptions.HTTPError(found_places['error'])
-        if not found_places:
-            return None
-        most_relevant = found_places[0]
-        lon, lat = most_relevant['GeoObject']['Point']['pos'].split(" ")
-        return lat, lon
-    except requests.exceptions.HTTPError as err:
-        logging.debug(err)
-    except requests.exceptions.ConnectionError as err:
-        logging.debug(err)
-    except requests.exceptions.Timeout as err:
-        logging.debug(err)
-    except requests.exceptions.JSONDecodeError:
-        logging.debug('Non valid format of json file')
-    except requests.exceptions.MissingSchema:
-        logging.debug('Non valid format of url. (ex. http://name.ru)')
-    except requests.exceptions.RequestException as err:
-        logging.debug(err)
+        found_places = request_places(address, apikey,
+                                      session or http_session)
+    except GeocoderError:
+        breaker.record_failure()
+        raise
+    breaker.record_success()
+    return parse_coordinates(found_places)
+
+
+def get_geocoder_backend():
+    """Return the callable named by GEOCODER_BACKEND.
+
+    It takes an address and an optional requests session, returns
+    (lat, lon) or None if nothing was found and raises GeocoderError.
+    """
+    return import_string(settings.GEOCODER_BACKEND)
+
+
+class LRUCache:
+    """LRU of at most maxsize values, each kept for ttl seconds if given."""
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            value, expires_at = self._data[key]
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires_at = None
+        if self.ttl is not None:
+            expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            self._data[key] = value, expires_at
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class GeocodingService:
+    """Geocoder front with an in-process LRU and the Location table behind it.
+
+    Addresses are looked up by address_key(), so different spellings of one
+    place share an entry. Entries are refreshed once older than the TTL,
+    "not found" answers are kept for the negative TTL, and concurrent
+    lookups of one address share a single upstream request.
+
+    The LRU keeps an entry for local_ttl only, and a stale one is read from
+    Location again, so coordinates that geocode_worker or a manager stores
+    reach the other processes.
+    """
+
+    def __init__(self, fetch=None, cache_size=None, ttl=None,
+                 negative_ttl=None, local_ttl=None):
+        self.fetch = fetch
+        self.ttl = ttl or settings.GEOCODER_CACHE_TTL
+        self.negative_ttl = negative_ttl or settings.GEOCODER_NEGATIVE_CACHE_TTL
+        local_ttl = local_ttl or settings.GEOCODER_LOCAL_CACHE_TTL
+        self._cache = LRUCache(cache_size or settings.GEOCODER_CACHE_SIZE,
+                               ttl=local_ttl.total_seconds())
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, address):
+        return self.lookup_many([address])[address]
+
+    def lookup_many(self, addresses, upstream=True):
+        """Map addresses to coordinates, or to None if nothing was found.
+
+        With upstream=False only known addresses are returned, stale or not,
+        and the geocoder itself is never called.
+        """
+        keys = {address: address_key(address) for address in addresses}
+        queries = {key: normalize_address(address)
+                   for address, key in keys.items()}
+        entries = self._load(set(keys.values()))
+
+        now = timezone.now()
+        coords = {}
+        for key, entry in entries.items():
+            if not key:
+                coords[key] = None
+            elif entry is not None and (not upstream or
+                                        self.is_fresh(entry, now)):
+                self._cache.set(key, entry)
+                coords[key] = entry.coords
+            elif upstream:
+                coords[key] = self._refresh(key, queries[key], stale=entry)
+        return {address: coords[key] for address, key in keys.items()
+                if key in coords}
+
+    def resolve(self, address):
+        key = address_key(address)
+        entry = self._load([key])[key]
+        if entry is None or not self.is_fresh(entry, timezone.now()):
+            entry = self._coalesced_fetch(key, normalize_address(address))
+        self._cache.set(key, entry)
+        return entry.coords
+
+    def is_fresh(self, entry, now):
+        ttl = self.ttl if entry.coords else self.negative_ttl
+        return now - entry.updated_at < ttl
+
+    def clear(self):
+        self._cache.clear()
+
+    def _load(self, keys):
+        now = timezone.now()
+        entries = {key: self._cache.get(key) for key in keys}
+        missing_keys = [key for key, entry in entries.items()
+                        if entry is None or not self.is_fresh(entry, now)]
+        if missing_keys:
+            for location in Location.objects.filter(key__in=missing_keys):
+                entries[location.key] = CacheEntry(
+                    (location.lat, location.lon)
+                    if location.lat is not None else None,
+                    location.last_update,
+                )
+        return entries
+
+    def _refresh(self, key, address, stale=None):
+        try:
+            entry = self._coalesced_fetch(key, address)
+        except GeocoderUnavailable:
+            return stale.coords if stale else None
+        except GeocoderError as err:
+            logger.warning('Geocoding of %r failed: %s', address, err)
+            return stale.coords if stale else None
+        self._cache.set(key, entry)
+        return entry.coords
+
+    def _coalesced_fetch(self, key, address):
+        with self._lock:
+            call = self._inflight.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._inflight[key] = Future()
+        if not is_leader:
+            return call.result()
+
+        try:
+            entry = self._fetch_and_store(key, address)
+        except BaseException as err:
+            call.set_exception(err)
+            raise
+        else:
+            call.set_result(entry)
+            return entry
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def _fetch_and_store(self, key, address):
+        with track_geocoder_call():
+            coords = (self.fetch or get_geocoder_backend())(address)
+        return self._store(key, address, coords)
+
+    def _store(self, key, address, coords):
+        lat, lon = coords if coords else (None, None)
+        location, _ = Location.objects.update_or_create(
+            key=key,
+            defaults={'address': address, 'lat': lat, 'lon': lon,
+                      'last_update': timezone.now()},
+        )
+        return CacheEntry(coords, location.last_update)
+
+
+geocoder = GeocodingService()
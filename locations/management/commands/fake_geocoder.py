@@ -0,0 +1,56 @@
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from django.core.management.base import BaseCommand
+
+from locations.fake_geocoder import FakeGeocoder
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = 'Запускает поддельный геокодер для тестов и нагрузочных прогонов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument('--latency-ms', type=int, default=0,
+                            help='Задержка каждого ответа')
+        parser.add_argument('--error-rate', type=float, default=0,
+                            help='Доля ответов с ошибкой 503')
+        parser.add_argument('--not-found-rate', type=float, default=0,
+                            help='Доля адресов, которые «не найдены»')
+        parser.add_argument('--seed', type=int,
+                            help='Зерно для повторяемой последовательности '
+                                 'ошибок')
+
+    def handle(self, *args, **options):
+        geocoder = FakeGeocoder(
+            latency=options['latency_ms'] / 1000,
+            error_rate=options['error_rate'],
+            not_found_rate=options['not_found_rate'],
+            seed=options['seed'],
+        )
+        handler = (WSGIRequestHandler if options['verbosity'] > 1
+                   else QuietRequestHandler)
+        server = make_server(options['host'], options['port'],
+                             geocoder.wsgi_app,
+                             server_class=ThreadingWSGIServer,
+                             handler_class=handler)
+        self.stdout.write(
+            f'Геокодер слушает http://{options["host"]}:{options["port"]}/, '
+            'укажите этот адрес в GEOCODER_URL'
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
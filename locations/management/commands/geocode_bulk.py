@@ -0,0 +1,191 @@
+import argparse
+import csv
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from foodcartapp.models import Order, Restaurant
+from foodcartapp.restaurant_index import invalidate_restaurant_index
+from locations.addresses import address_key, normalize_address
+from locations.locator import GeocoderError, get_geocoder_backend
+from locations.models import Location
+from locations.throttling import TokenBucket
+
+
+FAILED = object()
+
+
+def positive_float(value):
+    number = float(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError('должно быть больше нуля')
+    return number
+
+
+def positive_int(value):
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError('должно быть больше нуля')
+    return number
+
+
+class Command(BaseCommand):
+    help = 'Геокодирует адреса заказов, ресторанов и файла пачкой'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', action='append',
+                            choices=['orders', 'restaurants'],
+                            help='Откуда брать адреса, по умолчанию отовсюду')
+        parser.add_argument('--file',
+                            help='CSV или JSONL файл с колонкой address')
+        parser.add_argument('--workers', type=positive_int, default=8)
+        parser.add_argument('--rate', type=positive_float, default=10,
+                            help='Не больше стольких запросов в секунду')
+        parser.add_argument('--batch-size', type=positive_int, default=200)
+        parser.add_argument('--checkpoint', default='.geocode_bulk.checkpoint',
+                            help='Файл с уже обработанными адресами')
+        parser.add_argument('--resume', action='store_true',
+                            help='Пропустить адреса из файла прогресса')
+        parser.add_argument('--refresh', action='store_true',
+                            help='Запросить заново и свежие адреса')
+
+    def handle(self, *args, **options):
+        for option in ['workers', 'rate', 'batch_size']:
+            if options[option] <= 0:
+                raise CommandError(
+                    f'--{option.replace("_", "-")} должен быть больше нуля'
+                )
+        addresses = self.collect_addresses(options)
+        if not options['refresh']:
+            fresh_keys = set(
+                Location.objects.fresh().values_list('key', flat=True)
+            )
+            addresses = {key: address for key, address in addresses.items()
+                         if key not in fresh_keys}
+        if options['resume']:
+            done_addresses = read_checkpoint(options['checkpoint'])
+            addresses = {key: address for key, address in addresses.items()
+                         if address not in done_addresses}
+        elif os.path.exists(options['checkpoint']):
+            os.remove(options['checkpoint'])
+        addresses = sorted(addresses.values())
+        self.stdout.write(f'Адресов к геокодированию: {len(addresses)}')
+
+        bucket = TokenBucket(options['rate'])
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=options['workers'],
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+        fetch = get_geocoder_backend()
+
+        def geocode(address):
+            bucket.acquire()
+            try:
+                return address, fetch(address, session=session)
+            except GeocoderError as err:
+                self.stderr.write(f'{address}: {err}')
+                return address, FAILED
+
+        done, failed = 0, 0
+        batch_size = options['batch_size']
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor, \
+                open(options['checkpoint'], 'a',
+                     encoding='utf-8') as checkpoint:
+            for start in range(0, len(addresses), batch_size):
+                batch = addresses[start:start + batch_size]
+                results = dict(executor.map(geocode, batch))
+                results = {address: coords for address, coords
+                           in results.items() if coords is not FAILED}
+                save_locations(results)
+                checkpoint.writelines(f'{address}\n' for address in results)
+                checkpoint.flush()
+                done += len(results)
+                failed += len(batch) - len(results)
+                self.stdout.write(f'Обработано {done}, ошибок {failed}')
+
+        if 'restaurants' in self.sources(options):
+            fill_restaurants()
+
+    def sources(self, options):
+        if options['source']:
+            return options['source']
+        return [] if options['file'] else ['orders', 'restaurants']
+
+    def collect_addresses(self, options):
+        sources = self.sources(options)
+        addresses = set()
+        if 'orders' in sources:
+            addresses.update(
+                Order.objects.values_list('address', flat=True).distinct()
+            )
+        if 'restaurants' in sources:
+            addresses.update(
+                Restaurant.objects.values_list('address', flat=True)
+            )
+        if options['file']:
+            addresses.update(read_addresses(options['file']))
+        # one spelling per place is enough
+        addresses = {address_key(address): normalize_address(address)
+                     for address in addresses}
+        addresses.pop('', None)
+        return addresses
+
+
+def read_addresses(path):
+    try:
+        with open(path, encoding='utf-8') as file:
+            if path.endswith('.jsonl'):
+                return [json.loads(line)['address'] for line in file
+                        if line.strip()]
+            return [row['address'] for row in csv.DictReader(file)]
+    except (OSError, KeyError, ValueError) as err:
+        raise CommandError(f'Не удалось прочитать {path}: {err}')
+
+
+def read_checkpoint(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding='utf-8') as file:
+        return {line.rstrip('\n') for line in file}
+
+
+def save_locations(results):
+    now = timezone.now()
+    keys = {address: address_key(address) for address in results}
+    existing = Location.objects.in_bulk(keys.values(), field_name='key')
+    new_locations = []
+    for address, coords in results.items():
+        lat, lon = coords if coords else (None, None)
+        location = existing.get(keys[address])
+        if location is None:
+            new_locations.append(Location(
+                address=address, key=keys[address], lat=lat, lon=lon,
+                last_update=now,
+            ))
+        else:
+            location.lat, location.lon, location.last_update = lat, lon, now
+    Location.objects.bulk_create(new_locations, ignore_conflicts=True)
+    Location.objects.bulk_update(existing.values(),
+                                 ['lat', 'lon', 'last_update'])
+
+
+def fill_restaurants():
+    restaurants = list(Restaurant.objects.filter(lat__isnull=True))
+    locations = Location.objects.filter(lat__isnull=False).in_bulk(
+        {address_key(restaurant.address) for restaurant in restaurants},
+        field_name='key',
+    )
+    for restaurant in restaurants:
+        location = locations.get(address_key(restaurant.address))
+        if location:
+            restaurant.lat, restaurant.lon = location.lat, location.lon
+    Restaurant.objects.bulk_update(restaurants, ['lat', 'lon'])
+    invalidate_restaurant_index()
@@ -0,0 +1,105 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from foodcartapp.dispatch import dispatch_orders
+from locations.locator import (GeocoderError, GeocoderUnavailable, breaker,
+                               geocoder)
+from locations.models import GeocodingJob
+from star_burger.metrics import registry
+
+
+logger = logging.getLogger(__name__)
+
+LEASE = timedelta(minutes=5)
+MAX_ATTEMPTS = 5
+
+
+class Command(BaseCommand):
+    help = 'Обрабатывает очередь геокодирования адресов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=20)
+        parser.add_argument('--poll-interval', type=float, default=2,
+                            help='Пауза в секундах, когда очередь пуста')
+        parser.add_argument('--once', action='store_true',
+                            help='Разобрать очередь и завершиться')
+
+    def handle(self, *args, **options):
+        with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+            while True:
+                jobs = claim_jobs(options['batch_size'])
+                if jobs:
+                    list(executor.map(process_job, jobs))
+                if settings.DISPATCH_ON_CREATE:
+                    # new orders, and those waiting for these coordinates,
+                    # are dispatched here rather than in the order request
+                    dispatch_orders()
+                # the breaker and geocoder numbers of /metrics come from here
+                registry.flush()
+                if jobs:
+                    continue
+                if options['once']:
+                    registry.flush(force=True)
+                    return
+                time.sleep(options['poll_interval'])
+
+
+def claim_jobs(batch_size):
+    with transaction.atomic():
+        jobs = list(
+            GeocodingJob.objects.ready()
+            .select_for_update(skip_locked=True)
+            .order_by('run_after')[:batch_size]
+        )
+        GeocodingJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+            run_after=timezone.now() + LEASE,
+        )
+    return jobs
+
+
+def process_job(job):
+    try:
+        geocoder.resolve(job.address)
+    except GeocoderUnavailable:
+        # the geocoder is down, this is not the address's fault
+        GeocodingJob.objects.filter(pk=job.pk).update(
+            run_after=timezone.now() + timedelta(
+                seconds=breaker.retry_after()
+            ),
+        )
+    except GeocoderError as err:
+        logger.warning('Geocoding of %r failed: %s', job.address, err)
+        retry_job(job, err)
+    except Exception as err:
+        # a bug or a database error must not stop the whole worker
+        logger.exception('Geocoding of %r crashed', job.address)
+        retry_job(job, err)
+    else:
+        GeocodingJob.objects.filter(pk=job.pk).delete()
+    finally:
+        close_old_connections()
+
+
+def retry_job(job, err):
+    """Schedule another attempt, backing off and cooling down after many."""
+    attempts = job.attempts + 1
+    if attempts >= MAX_ATTEMPTS:
+        status = GeocodingJob.FAILED
+        delay = settings.GEOCODER_NEGATIVE_CACHE_TTL
+    else:
+        status = GeocodingJob.PENDING
+        delay = timedelta(minutes=2 ** attempts)
+    GeocodingJob.objects.filter(pk=job.pk).update(
+        attempts=attempts,
+        last_error=str(err),
+        status=status,
+        run_after=timezone.now() + delay,
+    )
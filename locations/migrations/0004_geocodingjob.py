@@ -0,0 +1,34 @@
+# Generated by Django 3.2 on 2026-10-18 18:55
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('locations', '0003_alter_location_address'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeocodingJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('address', models.CharField(max_length=100, unique=True, verbose_name='адрес')),
+                ('status', models.CharField(choices=[('PENDING', 'Ожидает'), ('FAILED', 'Не удалось')], default='PENDING', max_length=7, verbose_name='статус')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='попыток')),
+                ('last_error', models.TextField(blank=True, verbose_name='последняя ошибка')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='поставлена в')),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now, verbose_name='выполнить после')),
+            ],
+            options={
+                'verbose_name': 'Задача геокодирования',
+                'verbose_name_plural': 'Задачи геокодирования',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='geocodingjob',
+            index=models.Index(fields=['status', 'run_after'], name='locations_g_status_fe75ca_idx'),
+        ),
+    ]
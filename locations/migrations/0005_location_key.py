@@ -0,0 +1,124 @@
+import re
+
+from django.db import migrations, models
+
+
+# A copy of locations.addresses.address_key() as it was when this migration
+# was written, so later changes of the rules do not change what it does.
+ABBREVIATIONS = {
+    'ул': 'улица',
+    'пр': 'проспект',
+    'пр-т': 'проспект',
+    'пр-кт': 'проспект',
+    'просп': 'проспект',
+    'пер': 'переулок',
+    'пл': 'площадь',
+    'б-р': 'бульвар',
+    'бул': 'бульвар',
+    'ш': 'шоссе',
+    'наб': 'набережная',
+    'туп': 'тупик',
+    'мкр': 'микрорайон',
+    'мкрн': 'микрорайон',
+    'обл': 'область',
+    'пос': 'поселок',
+    'к': 'корпус',
+    'корп': 'корпус',
+    'стр': 'строение',
+}
+STREET_TYPES = {'улица', 'проспект', 'переулок', 'площадь', 'бульвар', 'шоссе',
+                'набережная', 'тупик', 'проезд'}
+# Words that are often left out and so must not tell addresses apart
+OPTIONAL_WORDS = {'г', 'город', 'д', 'дом'}
+
+WORD_RE = re.compile(r'\w+(?:-\w+)*')
+
+
+def address_key(address):
+    """Reduce an address to a key equal for spellings of the same place.
+
+    Case, "ё", punctuation, common abbreviations and the position of the
+    street type are ignored, so "г. Москва, ул. Тверская, д. 1" and
+    "москва тверская улица 1" share a key.
+    """
+    words = WORD_RE.findall(address.casefold().replace('ё', 'е'))
+    words = [ABBREVIATIONS.get(word, word) for word in words
+             if word not in OPTIONAL_WORDS]
+    for index in range(len(words) - 1):
+        if words[index] in STREET_TYPES and not words[index + 1].isdigit():
+            words[index], words[index + 1] = words[index + 1], words[index]
+    return ' '.join(words)
+
+
+def fill_keys(apps, schema_editor):
+    Location = apps.get_model('locations', 'Location')
+    GeocodingJob = apps.get_model('locations', 'GeocodingJob')
+
+    # keep the newest answer among spellings of one address, found ones first
+    locations = Location.objects.annotate(
+        not_found=models.Case(
+            models.When(lat__isnull=True, then=models.Value(1)),
+            default=models.Value(0),
+            output_field=models.IntegerField(),
+        ),
+    ).order_by('not_found', '-last_update')
+    seen_keys = set()
+    for location in locations.iterator():
+        key = address_key(location.address)
+        if key in seen_keys or not key:
+            location.delete()
+            continue
+        seen_keys.add(key)
+        location.key = key
+        location.save(update_fields=['key'])
+
+    seen_keys = set()
+    for job in GeocodingJob.objects.order_by('created_at').iterator():
+        key = address_key(job.address)
+        if key in seen_keys or not key:
+            job.delete()
+            continue
+        seen_keys.add(key)
+        job.key = key
+        job.save(update_fields=['key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('locations', '0004_geocodingjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='location',
+            name='key',
+            field=models.CharField(max_length=200, null=True, verbose_name='ключ адреса'),
+        ),
+        migrations.AddField(
+            model_name='geocodingjob',
+            name='key',
+            field=models.CharField(max_length=200, null=True, verbose_name='ключ адреса'),
+        ),
+        migrations.AlterField(
+            model_name='location',
+            name='address',
+            field=models.CharField(max_length=100, verbose_name='адрес'),
+        ),
+        migrations.AlterField(
+            model_name='geocodingjob',
+            name='address',
+            field=models.CharField(max_length=100, verbose_name='адрес'),
+        ),
+        migrations.RunPython(fill_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='location',
+            name='key',
+            field=models.CharField(editable=False, help_text='Адрес без регистра, знаков препинания и сокращений', max_length=200, unique=True, verbose_name='ключ адреса'),
+        ),
+        migrations.AlterField(
+            model_name='geocodingjob',
+            name='key',
+            field=models.CharField(editable=False, max_length=200, unique=True, verbose_name='ключ адреса'),
+        ),
+    ]
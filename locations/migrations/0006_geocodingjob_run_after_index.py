@@ -0,0 +1,21 @@
+# Generated by Django 3.2 on 2026-10-18 19:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('locations', '0005_location_key'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='geocodingjob',
+            name='locations_g_status_fe75ca_idx',
+        ),
+        migrations.AddIndex(
+            model_name='geocodingjob',
+            index=models.Index(fields=['run_after'], name='locations_g_run_aft_e2793d_idx'),
+        ),
+    ]
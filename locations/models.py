@@ -1,18 +1,39 @@
+from django.conf import settings
 from django.db import models
+from django.db.models import Q
 from django.utils import timezone
 
+from .addresses import address_key, normalize_address
+
+
+class LocationQuerySet(models.QuerySet):
+    def fresh(self):
+        now = timezone.now()
+        return self.filter(
+            Q(lat__isnull=False,
+              last_update__gte=now - settings.GEOCODER_CACHE_TTL) |
+            Q(lat__isnull=True,
+              last_update__gte=now - settings.GEOCODER_NEGATIVE_CACHE_TTL)
+        )
+
 
 class Location(models.Model):
     address = models.CharField(
         'адрес',
         max_length=100,
+    )
+    key = models.CharField(
+        'ключ адреса',
+        max_length=200,
         unique=True,
-        db_index=True,
+        editable=False,
+        help_text='Адрес без регистра, знаков препинания и сокращений',
     )
     lat = models.FloatField(null=True, verbose_name='Широта')
     lon = models.FloatField(null=True, verbose_name='Долгота')
     last_update = models.DateTimeField(verbose_name='Получены в',
                                        default=timezone.now)
+    objects = LocationQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Место'
@@ -20,3 +41,69 @@ class Location(models.Model):
 
     def __str__(self):
         return self.address
+
+    def save(self, *args, **kwargs):
+        self.key = address_key(self.address)
+        super().save(*args, **kwargs)
+
+
+class GeocodingJobQuerySet(models.QuerySet):
+    def enqueue(self, addresses):
+        addresses = {address_key(address): normalize_address(address)
+                     for address in addresses}
+        addresses.pop('', None)
+        if not addresses:
+            return
+        known_keys = set(
+            Location.objects.fresh().filter(key__in=addresses)
+                    .values_list('key', flat=True)
+        )
+        self.bulk_create(
+            [GeocodingJob(key=key, address=address)
+             for key, address in addresses.items() if key not in known_keys],
+            ignore_conflicts=True,
+        )
+
+    def ready(self):
+        # failed jobs come back once their cool-down is over
+        return self.filter(run_after__lte=timezone.now())
+
+
+class GeocodingJob(models.Model):
+    PENDING = 'PENDING'
+    FAILED = 'FAILED'
+    STATUS_TYPE = (
+        (PENDING, 'Ожидает'),
+        (FAILED, 'Не удалось'),
+    )
+    address = models.CharField(
+        'адрес',
+        max_length=100,
+    )
+    key = models.CharField(
+        'ключ адреса',
+        max_length=200,
+        unique=True,
+        editable=False,
+    )
+    status = models.CharField(
+        'статус',
+        choices=STATUS_TYPE,
+        max_length=7,
+        default=PENDING,
+    )
+    attempts = models.PositiveSmallIntegerField('попыток', default=0)
+    last_error = models.TextField('последняя ошибка', blank=True)
+    created_at = models.DateTimeField('поставлена в', default=timezone.now)
+    run_after = models.DateTimeField('выполнить после', default=timezone.now)
+    objects = GeocodingJobQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Задача геокодирования'
+        verbose_name_plural = 'Задачи геокодирования'
+        indexes = [
+            models.Index(fields=['run_after']),
+        ]
+
+    def __str__(self):
+        return self.address
@@ -0,0 +1,133 @@
+import math
+import threading
+from collections import defaultdict
+
+from .distance import distance_matrix
+
+
+KM_PER_DEGREE = 111.195
+
+
+class GridIndex:
+    """Points bucketed into a lat/lon grid for nearest-neighbour queries.
+
+    A query walks rings of cells outwards from the point and stops as soon
+    as nothing beyond the current ring can be closer than what was found.
+    """
+
+    def __init__(self, cell_size_km=5):
+        self.cell_size = cell_size_km / KM_PER_DEGREE
+        self._cells = defaultdict(dict)
+        self._points = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._points)
+
+    def __contains__(self, key):
+        return key in self._points
+
+    def add(self, key, lat, lon):
+        with self._lock:
+            self.discard(key)
+            if lat is None or lon is None:
+                return
+            self._points[key] = (lat, lon)
+            self._cells[self._cell(lat, lon)][key] = (lat, lon)
+
+    def discard(self, key):
+        with self._lock:
+            point = self._points.pop(key, None)
+            if point is None:
+                return
+            cell = self._cell(*point)
+            del self._cells[cell][key]
+            if not self._cells[cell]:
+                del self._cells[cell]
+
+    def nearest(self, lat, lon, k=None, radius_km=None, keys=None):
+        """Return up to k (key, km) pairs nearest first.
+
+        Only points within radius_km are returned and, if keys is given,
+        only points with those keys.
+        """
+        with self._lock:
+            if keys is None:
+                candidates_count = len(self._points)
+            else:
+                keys = {key for key in keys if key in self._points}
+                candidates_count = len(keys)
+            center = self._cell(lat, lon)
+            max_ring = self._max_ring(center)
+
+            found = {}
+            ring = 0
+            while len(found) < candidates_count:
+                if 8 * ring >= candidates_count - len(found):
+                    points = self._remaining_points(found, keys)
+                    exhausted = True
+                else:
+                    points = self._ring_points(center, ring, keys)
+                    exhausted = ring >= max_ring
+                if points:
+                    distances = distance_matrix([(lat, lon)], points.values())
+                    found.update(zip(points.keys(), distances[0]))
+                if exhausted:
+                    break
+
+                bound = self._ring_bound(lat, ring)
+                if radius_km is not None and bound > radius_km:
+                    break
+                if k is not None and sum(
+                    1 for km in found.values() if km <= bound
+                ) >= k:
+                    break
+                ring += 1
+
+        nearest = sorted(
+            (km, key) for key, km in found.items()
+            if radius_km is None or km <= radius_km
+        )
+        return [(key, float(km)) for km, key in nearest[:k]]
+
+    def _cell(self, lat, lon):
+        return (math.floor(lat / self.cell_size),
+                math.floor(lon / self.cell_size))
+
+    def _max_ring(self, center):
+        if not self._cells:
+            return 0
+        return max(
+            max(abs(row - center[0]), abs(column - center[1]))
+            for row, column in self._cells
+        )
+
+    def _ring_points(self, center, ring, keys):
+        row, column = center
+        if ring == 0:
+            cells = [center]
+        else:
+            cells = [(row + offset, column + side)
+                     for offset in range(-ring, ring + 1)
+                     for side in (-ring, ring)]
+            cells += [(row + side, column + offset)
+                      for offset in range(-ring + 1, ring)
+                      for side in (-ring, ring)]
+        points = {}
+        for cell in cells:
+            for key, point in self._cells.get(cell, {}).items():
+                if keys is None or key in keys:
+                    points[key] = point
+        return points
+
+    def _remaining_points(self, found, keys):
+        return {
+            key: point for key, point in self._points.items()
+            if key not in found and (keys is None or key in keys)
+        }
+
+    def _ring_bound(self, lat, ring):
+        """Lower bound in km on the distance to points outside the ring."""
+        farthest_lat = min(abs(lat) + (ring + 1) * self.cell_size, 89.0)
+        return (ring * self.cell_size * KM_PER_DEGREE
+                * math.cos(math.radians(farthest_lat)))
@@ -1,3 +1,276 @@
-from django.test import TestCase
+import random
+import threading
+from datetime import timedelta
+from unittest import mock
+from wsgiref.simple_server import make_server
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from foodcartapp.testing import BudgetMixin
+from .addresses import address_key
+from .distance import distance_matrix
+from .fake_geocoder import FakeGeocoder, fake_coordinates
+from .locator import (GeocoderError, GeocoderUnavailable, GeocodingService,
+                      breaker, geocoder, request_coordinates)
+from .management.commands.fake_geocoder import (QuietRequestHandler,
+                                                ThreadingWSGIServer)
+from .management.commands.geocode_worker import MAX_ATTEMPTS, process_job
+from .models import GeocodingJob, Location
+from .spatial import GridIndex
+from .throttling import CircuitBreaker
+
+
+def serve(test, geocoder):
+    server = make_server('127.0.0.1', 0, geocoder.wsgi_app,
+                         server_class=ThreadingWSGIServer,
+                         handler_class=QuietRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    test.addCleanup(server.server_close)
+    test.addCleanup(server.shutdown)
+    return f'http://127.0.0.1:{server.server_port}/'
+
+
+def unreachable_geocoder(address):
+    raise GeocoderError('geocoder must not be called')
+
+
+class GeocodingServiceBudgetTest(BudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.addresses = [f'москва, тверская {number}' for number in range(500)]
+        Location.objects.bulk_create(
+            Location(address=address, key=address_key(address),
+                     lat=55.75, lon=37.61)
+            for address in cls.addresses
+        )
+
+    def test_known_addresses_take_one_query(self):
+        service = GeocodingService(fetch=unreachable_geocoder)
+        with self.assertBudget(queries=1, seconds=0.2):
+            coords = service.lookup_many(self.addresses)
+        self.assertEqual(len(coords), len(self.addresses))
+        with self.assertBudget(queries=0, seconds=0.05):
+            service.lookup_many(self.addresses)
+
+    def test_cached_lookup_skips_unknown_addresses(self):
+        service = GeocodingService(fetch=unreachable_geocoder)
+        with self.assertBudget(queries=1, seconds=0.1):
+            coords = service.lookup_many(['Казань, Баумана 1'],
+                                         upstream=False)
+        self.assertEqual(coords, {})
+
+
+class GridIndexBudgetTest(BudgetMixin, SimpleTestCase):
+    def test_nearest_matches_brute_force(self):
+        rng = random.Random(1)
+        points = [(55 + rng.random() * 2, 36 + rng.random() * 3)
+                  for _ in range(10000)]
+        index = GridIndex(cell_size_km=5)
+        for key, (lat, lon) in enumerate(points):
+            index.add(key, lat, lon)
+
+        origin = (55.75, 37.61)
+        with self.assertBudget(queries=0, seconds=0.05):
+            nearest = index.nearest(*origin, k=10, radius_km=50)
+        distances = distance_matrix([origin], points)[0]
+        self.assertEqual([key for key, km in nearest],
+                         list(distances.argsort()[:10]))
+
+
+class FakeGeocoderTest(TestCase):
+    def test_coordinates_depend_only_on_address(self):
+        geocoder = FakeGeocoder(not_found_rate=0.5)
+        addresses = [f'Москва, Тверская {number}' for number in range(100)]
+        first = [geocoder(address) for address in addresses]
+        self.assertEqual(first, [geocoder(address) for address in addresses])
+        self.assertEqual(first[0], fake_coordinates(addresses[0], 0.5))
+        self.assertTrue(any(coords is None for coords in first))
+        self.assertTrue(any(coords is not None for coords in first))
+
+    def test_served_over_http_in_yandex_format(self):
+        url = serve(self, FakeGeocoder())
+        with override_settings(GEOCODER_URL=url):
+            coords = request_coordinates('Москва, Тверская 1')
+        self.assertEqual(coords, fake_coordinates('Москва, Тверская 1'))
+
+    @override_settings(
+        GEOCODER_BACKEND='locations.fake_geocoder.fake_geocoder',
+    )
+    def test_backend_is_taken_from_settings(self):
+        coords = GeocodingService().lookup('Москва, Тверская 1')
+        self.assertEqual(coords, fake_coordinates('Москва, Тверская 1'))
+        self.assertTrue(Location.objects.filter(lat=coords[0]).exists())
+
+    def test_failing_geocoder_stores_nothing(self):
+        service = GeocodingService(fetch=FakeGeocoder(error_rate=1))
+        self.assertIsNone(service.lookup('Москва, Тверская 1'))
+        self.assertFalse(Location.objects.exists())
+
+
+class CircuitBreakerTest(SimpleTestCase):
+    def setUp(self):
+        self.now = 0
+        self.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10,
+                                      clock=lambda: self.now)
+
+    def test_opens_after_failures_in_a_row(self):
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.retry_after(), 10)
+
+    def test_lets_one_trial_call_through_after_timeout(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.now = 10
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertFalse(self.breaker.allow())
+        self.now = 20
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertTrue(self.breaker.allow())
+
+
+class CountingGeocoder(FakeGeocoder):
+    calls = 0
+
+    def __call__(self, address, session=None):
+        self.calls += 1
+        return super().__call__(address, session)
+
+
+@override_settings(GEOCODER_RETRIES=1, GEOCODER_RETRY_BACKOFF=0)
+class ResilientClientTest(TestCase):
+    def setUp(self):
+        breaker.reset()
+        self.addCleanup(breaker.reset)
+        self.upstream = CountingGeocoder(error_rate=1)
+        self.url = serve(self, self.upstream)
+
+    def test_retries_then_fails_fast_while_circuit_is_open(self):
+        with override_settings(GEOCODER_URL=self.url):
+            for _ in range(breaker.failure_threshold):
+                with self.assertRaises(GeocoderError):
+                    request_coordinates('Москва, Тверская 1')
+            self.assertEqual(self.upstream.calls,
+                             2 * breaker.failure_threshold)
+            with self.assertRaises(GeocoderUnavailable):
+                request_coordinates('Москва, Тверская 1')
+        self.assertEqual(self.upstream.calls, 2 * breaker.failure_threshold)
+
+    def test_stale_coordinates_are_served_while_circuit_is_open(self):
+        Location.objects.create(
+            address='Москва, Тверская 1', lat=55.75, lon=37.61,
+            last_update=timezone.now() - timedelta(days=365),
+        )
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+        service = GeocodingService(fetch=request_coordinates)
+        with override_settings(GEOCODER_URL=self.url):
+            coords = service.lookup('Москва, Тверская 1')
+        self.assertEqual(coords, (55.75, 37.61))
+        self.assertEqual(self.upstream.calls, 0)
+
+
+class AddressKeyTest(SimpleTestCase):
+    def test_spellings_of_one_address_share_a_key(self):
+        self.assertEqual(address_key('Москва, Тверская 1'),
+                         address_key('москва тверская д.1'))
+        self.assertEqual(address_key('г. Москва, ул. Тверская, дом 1'),
+                         address_key('Москва Тверская улица 1'))
+        self.assertEqual(address_key('Ленинградский пр-т, 37, корп. 2'),
+                         'ленинградский проспект 37 корпус 2')
+
+    def test_different_places_keep_different_keys(self):
+        self.assertNotEqual(address_key('Тверская 1'), address_key('Тверская 11'))
+        self.assertNotEqual(address_key('Тверская 1'), address_key('Тверской 1'))
+
+
+class AddressDedupTest(TestCase):
+    def test_spellings_of_one_address_take_one_geocoder_call(self):
+        upstream = CountingGeocoder()
+        service = GeocodingService(fetch=upstream)
+        coords = service.lookup_many(['Москва, Тверская 1',
+                                      'москва тверская д.1'])
+        self.assertEqual(len(set(coords.values())), 1)
+        service.clear()
+        service.lookup('МОСКВА, ТВЕРСКАЯ, 1')
+        self.assertEqual(upstream.calls, 1)
+        self.assertEqual(Location.objects.count(), 1)
+
+    def test_queue_holds_one_job_per_place(self):
+        GeocodingJob.objects.enqueue(['Москва, Тверская 1',
+                                      'москва тверская д.1'])
+        GeocodingJob.objects.enqueue(['Москва,  Тверская 1'])
+        self.assertEqual(GeocodingJob.objects.count(), 1)
+
+
+class LocalCacheTest(TestCase):
+    address = 'Москва, Тверская 1'
+
+    def test_changed_location_is_seen_after_local_ttl(self):
+        location = Location.objects.create(address=self.address)
+        service = GeocodingService(fetch=unreachable_geocoder)
+        with mock.patch('locations.locator.time.monotonic', return_value=0):
+            coords = service.lookup_many([self.address], upstream=False)
+        self.assertEqual(coords, {self.address: None})
+
+        location.lat, location.lon = 55.75, 37.61
+        location.save()
+        with mock.patch('locations.locator.time.monotonic', return_value=1):
+            coords = service.lookup_many([self.address], upstream=False)
+        self.assertEqual(coords, {self.address: None})
+        with mock.patch('locations.locator.time.monotonic', return_value=61):
+            coords = service.lookup_many([self.address], upstream=False)
+        self.assertEqual(coords, {self.address: (55.75, 37.61)})
+
+    def test_stale_entry_is_read_again(self):
+        location = Location.objects.create(
+            address=self.address, lat=55.75, lon=37.61,
+            last_update=timezone.now() - timedelta(days=365),
+        )
+        service = GeocodingService(fetch=unreachable_geocoder)
+        service.lookup_many([self.address], upstream=False)
+
+        location.lat, location.last_update = 55.76, timezone.now()
+        location.save()
+        coords = service.lookup_many([self.address], upstream=False)
+        self.assertEqual(coords, {self.address: (55.76, 37.61)})
+
+
+class GeocodeWorkerTest(TestCase):
+    def setUp(self):
+        GeocodingJob.objects.enqueue(['Москва, Тверская 1'])
+        self.job = GeocodingJob.objects.get()
+
+    def test_unexpected_error_keeps_the_job_for_retry(self):
+        with mock.patch.object(geocoder, 'resolve',
+                               side_effect=RuntimeError('boom')), \
+                self.assertLogs('locations.management.commands.'
+                                'geocode_worker', 'ERROR'):
+            process_job(self.job)
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, GeocodingJob.PENDING)
+        self.assertEqual(self.job.attempts, 1)
+        self.assertEqual(self.job.last_error, 'boom')
+        self.assertFalse(GeocodingJob.objects.ready().exists())
+
+    def test_failed_job_is_retried_after_cool_down(self):
+        self.job.attempts = MAX_ATTEMPTS - 1
+        with mock.patch.object(geocoder, 'resolve',
+                               side_effect=GeocoderError('boom')), \
+                self.assertLogs('locations.management.commands.'
+                                'geocode_worker', 'WARNING'):
+            process_job(self.job)
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, GeocodingJob.FAILED)
+        self.assertFalse(GeocodingJob.objects.ready().exists())
+
+        GeocodingJob.objects.update(run_after=timezone.now())
+        self.assertTrue(GeocodingJob.objects.ready().exists())
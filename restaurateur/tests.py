@@ -1,3 +1,205 @@
-from django.test import TestCase
+import json
+import shutil
+import tempfile
+from datetime import timedelta
+from time import monotonic
+from urllib.parse import quote
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from foodcartapp.availability import AVAILABILITY_CACHE_KEY
+from foodcartapp.models import Order, Product, Restaurant, RestaurantMenuItem
+from foodcartapp.testing import SeededBudgetMixin, create_manager
+from locations.models import GeocodingJob, Location
+from star_burger.db import database_sync_to_async
+from .views import LAST_ORDER_CHANGE_KEY
+
+
+class BudgetTest(SeededBudgetMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.manager)
+
+    def test_orders_pages(self):
+        url = reverse('restaurateur:view_orders')
+        with self.assertBudget(queries=14, seconds=1):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        next_page_url = response.context['next_page_url']
+        self.assertTrue(next_page_url)
+        with self.assertBudget(queries=12, seconds=1):
+            response = self.client.get(url + next_page_url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_filtered_orders(self):
+        url = reverse('restaurateur:view_orders')
+        with self.assertBudget(queries=14, seconds=1):
+            response = self.client.get(url, {'status': Order.COOKING,
+                                             'payment': Order.CASH})
+        self.assertTrue(all(order.status == Order.COOKING
+                            for order in response.context['order_items']))
+
+    def test_products(self):
+        with self.assertBudget(queries=2, seconds=0.2):
+            response = self.client.get(reverse('restaurateur:ProductsView'))
+        self.assertEqual(response.status_code, 200)
+
+        url = reverse('restaurateur:ProductsAvailability')
+        with self.assertBudget(queries=5, seconds=1):
+            response = self.client.get(url)
+        self.assertEqual(len(response.json()['products']),
+                         len(self.products))
+        with self.assertBudget(queries=2, seconds=0.1):
+            self.client.get(url)
+
+    def test_restaurants(self):
+        with self.assertBudget(queries=3, seconds=0.5):
+            response = self.client.get(reverse('restaurateur:RestaurantView'))
+        self.assertEqual(response.status_code, 200)
+
+
+class GeocodingStateTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = create_manager()
+        for address in ['Москва, Тверская 1', 'Нигде', 'Москва, Арбат 1']:
+            Order.objects.create(firstname='Иван', lastname='Петров',
+                                 phonenumber='+79123456789', address=address)
+        Location.objects.create(address='Нигде', lat=None, lon=None)
+        GeocodingJob.objects.enqueue(['Москва, Арбат 1'])
+        GeocodingJob.objects.update(status=GeocodingJob.FAILED,
+                                    run_after=timezone.now() + timedelta(1))
+
+    def test_addresses_given_up_on_are_not_shown_as_pending(self):
+        self.client.force_login(self.manager)
+        response = self.client.get(reverse('restaurateur:view_orders'))
+        states = {order.address: (order.coords_pending, order.coords_not_found)
+                  for order in response.context['order_items']}
+        self.assertEqual(states, {
+            'Москва, Тверская 1': (True, False),
+            'Нигде': (False, True),
+            'Москва, Арбат 1': (False, True),
+        })
+        self.assertContains(response, 'Адрес не найден', count=2)
+
+
+class SharedAvailabilityCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = create_manager()
+        cls.restaurant = Restaurant.objects.create(name='Рядом')
+        cls.product = Product.objects.create(name='Бургер', price=300,
+                                             image='burger.jpg')
+        RestaurantMenuItem.objects.create(restaurant=cls.restaurant,
+                                          product=cls.product)
+
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        shared_cache = override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': cache_dir,
+        }})
+        shared_cache.enable()
+        self.addCleanup(shared_cache.disable)
+        # the cache as another gunicorn worker sees it
+        self.other_worker_cache = FileBasedCache(cache_dir, {})
+        self.client.force_login(self.manager)
+
+    def test_toggle_invalidates_matrix_for_all_workers(self):
+        url = reverse('restaurateur:ProductsAvailability')
+        self.client.get(url)
+        self.assertIsNotNone(
+            self.other_worker_cache.get(AVAILABILITY_CACHE_KEY)
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, [{'restaurant': self.restaurant.id,
+                                    'product': self.product.id,
+                                    'availability': False}],
+                             content_type='application/json')
+        self.assertIsNone(self.other_worker_cache.get(AVAILABILITY_CACHE_KEY))
+
+
+@override_settings(ORDERS_POLL_TIMEOUT=0)
+class OrderUpdatesTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.manager = create_manager()
+        self.client.force_login(self.manager)
+        self.order = Order.objects.create(
+            firstname='Иван', lastname='Петров', phonenumber='+79123456789',
+            address='Москва, Тверская 1',
+        )
+
+    def open_board(self, **filters):
+        response = self.client.get(reverse('restaurateur:view_orders'),
+                                   filters)
+        return response.context['updates_url']
+
+    def poll(self, url):
+        cache.delete(LAST_ORDER_CHANGE_KEY)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_changes_after_opening_the_board_are_reported(self):
+        url = self.open_board()
+        Order.objects.filter(pk=self.order.pk).update(
+            comment='Позвонить', updated_at=timezone.now(),
+        )
+        updates = self.poll(url)
+        self.assertEqual([(order['id'], order['visible'])
+                          for order in updates['orders']],
+                         [(self.order.id, True)])
+        self.assertIn('Позвонить', updates['orders'][0]['html'])
+
+        url = f'{reverse("restaurateur:order_updates")}?since=' \
+              f'{quote(updates["cursor"])}'
+        self.assertEqual(self.poll(url)['orders'], [])
+
+    def test_board_filters_apply_to_changes(self):
+        url = self.open_board(status=Order.PROCESSED)
+        self.order.status = Order.PROCESSED
+        self.order.save()
+        other = Order.objects.create(
+            firstname='Пётр', lastname='Иванов', phonenumber='+79123456780',
+            address='Москва, Арбат 1',
+        )
+        updates = self.poll(url)
+        self.assertEqual({order['id']: order['visible']
+                          for order in updates['orders']},
+                         {self.order.id: True, other.id: False})
+
+    def test_naive_cursor_is_rejected(self):
+        url = reverse('restaurateur:order_updates')
+        response = self.client.get(url, {'since': '2020-01-01T00:00:00|0'})
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(ORDERS_POLL_TIMEOUT=5)
+    def test_wsgi_board_polls_without_waiting(self):
+        updates = self.poll(self.open_board())
+        url = f'{reverse("restaurateur:order_updates")}?since=' \
+              f'{quote(updates["cursor"])}'
+        started_at = monotonic()
+        updates = self.poll(url)
+        self.assertLess(monotonic() - started_at, 1)
+        self.assertEqual(updates['orders'], [])
+        self.assertEqual(updates['retry_after'], 5)
+
+    async def test_asgi_board_asks_again_at_once(self):
+        url = await database_sync_to_async(self.open_board)()
+        await database_sync_to_async(self.async_client.force_login)(
+            self.manager,
+        )
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['retry_after'], 0)
+
+    def test_only_managers_get_updates(self):
+        self.client.logout()
+        response = self.client.get(reverse('restaurateur:order_updates'))
+        self.assertEqual(response.status_code, 403)
@@ -1,18 +1,39 @@
+import asyncio
+import base64
+import binascii
+import json
 import requests
-import copy
+from datetime import datetime, time, timedelta
+from time import monotonic
 
 from django import forms
+from django.conf import settings
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponseForbidden, JsonResponse
 from django.shortcuts import redirect, render
+from django.template.loader import render_to_string
 from django.views import View
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.contrib.auth.decorators import user_passes_test
 from django.contrib.auth import authenticate, login
 from django.contrib.auth import views as auth_views
-from geopy import distance
+from django.db.models import Max, Q
+from django.utils import timezone
+from django.views.decorators.http import require_http_methods
+from rest_framework import serializers
+
+from foodcartapp.availability import (
+    get_availability_matrix, set_menu_availability,
+)
+from foodcartapp.caching import payload_response
+from foodcartapp.models import Restaurant, Order
+from foodcartapp.restaurant_index import get_restaurant_index
+from locations.addresses import address_key
+from locations.locator import geocoder
+from locations.models import GeocodingJob
+from star_burger.db import database_sync_to_async
 
-from foodcartapp.models import Product, Restaurant, Order
-from locations.locator import fetch_coordinates
-from locations.models import Location
 
 class Login(forms.Form):
     username = forms.CharField(
@@ -31,6 +52,86 @@ class Login(forms.Form):
     )
 
 
+def encode_cursor(order):
+    cursor = f'{order.status}:{order.id}'.encode()
+    return base64.urlsafe_b64encode(cursor).decode()
+
+
+def decode_cursor(cursor):
+    status, order_id = base64.urlsafe_b64decode(cursor).decode().split(':')
+    return status, int(order_id)
+
+
+class OrdersFilter(forms.Form):
+    status = forms.ChoiceField(
+        label='Статус', required=False,
+        choices=[('', 'Все необработанные'), *Order.STATUS_TYPE],
+        widget=forms.Select(attrs={'class': 'form-control'}),
+    )
+    payment = forms.ChoiceField(
+        label='Оплата', required=False,
+        choices=[('', 'Любая'), *Order.PAYMENT_TYPE],
+        widget=forms.Select(attrs={'class': 'form-control'}),
+    )
+    restaurant = forms.ModelChoiceField(
+        label='Ресторан', required=False,
+        queryset=Restaurant.objects.order_by('name'),
+        empty_label='Любой',
+        widget=forms.Select(attrs={'class': 'form-control'}),
+    )
+    registered_from = forms.DateField(
+        label='Зарегистрирован с', required=False,
+        widget=forms.DateInput(attrs={'class': 'form-control',
+                                      'type': 'date'}),
+    )
+    registered_to = forms.DateField(
+        label='по', required=False,
+        widget=forms.DateInput(attrs={'class': 'form-control',
+                                      'type': 'date'}),
+    )
+    after = forms.CharField(required=False, widget=forms.HiddenInput)
+
+    def clean_after(self):
+        if not self.cleaned_data['after']:
+            return None
+        try:
+            return decode_cursor(self.cleaned_data['after'])
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise forms.ValidationError('Неверная ссылка на страницу.')
+
+    def filter(self, orders):
+        filters = self.cleaned_data
+        if filters['status']:
+            orders = orders.filter(status=filters['status'])
+        else:
+            orders = orders.filter(status__in=[Order.COOKING,
+                                               Order.UNPROCESSED])
+        if filters['payment']:
+            orders = orders.filter(payment=filters['payment'])
+        if filters['restaurant']:
+            orders = orders.filter(assigned_restaurant=filters['restaurant'])
+        if filters['registered_from']:
+            orders = orders.filter(
+                registered_at__gte=start_of_day(filters['registered_from'])
+            )
+        if filters['registered_to']:
+            orders = orders.filter(
+                registered_at__lt=start_of_day(
+                    filters['registered_to'] + timedelta(days=1)
+                )
+            )
+        if filters['after']:
+            status, order_id = filters['after']
+            orders = orders.filter(
+                Q(status__lt=status) | Q(status=status, id__gt=order_id)
+            )
+        return orders.order_by('-status', 'id')
+
+
+def start_of_day(date):
+    return timezone.make_aware(datetime.combine(date, time.min))
+
+
 class LoginView(View):
     def get(self, request, *args, **kwargs):
         form = Login()
@@ -68,29 +169,38 @@ def is_manager(user):
 
 @user_passes_test(is_manager, login_url='restaurateur:login')
 def view_products(request):
-    restaurants = list(Restaurant.objects.order_by('name'))
-    products = list(Product.objects.prefetch_related('menu_items'))
-
-    default_availability = {restaurant.id: False for restaurant
-                            in restaurants}
-    products_with_restaurants = []
-    for product in products:
-
-        availability = {
-            **default_availability,
-            **{item.restaurant_id: item.availability for item
-               in product.menu_items.all()},
-        }
-        orderer_availability = [availability[restaurant.id] for restaurant
-                                in restaurants]
-
-        products_with_restaurants.append(
-            (product, orderer_availability)
-        )
+    return render(request, template_name="products_list.html")
+
+
+class AvailabilityChangeSerializer(serializers.Serializer):
+    restaurant = serializers.IntegerField()
+    product = serializers.IntegerField()
+    availability = serializers.BooleanField()
+
+
+@user_passes_test(is_manager, login_url='restaurateur:login')
+@require_http_methods(['GET', 'HEAD', 'POST'])
+def view_products_availability(request):
+    if request.method != 'POST':
+        return payload_response(request, get_availability_matrix())
 
-    return render(request, template_name="products_list.html", context={
-        'products_with_restaurants': products_with_restaurants,
-        'restaurants': restaurants,
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'detail': 'Ожидается JSON.'}, status=400)
+    serializer = AvailabilityChangeSerializer(data=payload, many=True)
+    if not serializer.is_valid():
+        return JsonResponse({'errors': serializer.errors}, status=400)
+    changed, unknown_pairs = set_menu_availability({
+        (change['restaurant'], change['product']): change['availability']
+        for change in serializer.validated_data
+    })
+    return JsonResponse({
+        'changed': changed,
+        'unknown': [
+            {'restaurant': restaurant_id, 'product': product_id}
+            for restaurant_id, product_id in unknown_pairs
+        ],
     })
 
 
@@ -101,68 +211,206 @@ def view_restaurants(request):
     })
 
 
-@user_passes_test(is_manager, login_url='restaurateur:login')
-def view_orders(request):
-    orders = (Order.objects.filter(status__in=['COOKING', 'UNPROCESSED'])
-                   .select_related('assigned_restaurant')
-                   .prefetch_related('elements__product')
-                   .count_total_sums().order_by('-status', 'id'))
-    restaurants = Restaurant.objects.prefetch_related('menu_items__product')
+def prepare_orders(orders):
+    unassigned_orders = [order for order in orders
+                         if not order.assigned_restaurant]
+    available_restaurants = Restaurant.objects.available_for(
+        unassigned_orders
+    )
+
     customer_addresses = {order.address for order in orders}
-    existed_locations = (
-        Location.objects.filter(address__in=customer_addresses).values()
+    customer_coords = geocoder.lookup_many(customer_addresses, upstream=False)
+    GeocodingJob.objects.enqueue(customer_addresses)
+    failed_addresses = failed_geocoding(
+        {order.address for order in unassigned_orders}
+        - customer_coords.keys()
     )
-    existed_locations = {
-        location['address']: (location['lat'], location['lon'])
-        for location in existed_locations
-    }
-    existed_addresses = existed_locations.keys()
-    new_addresses = customer_addresses - existed_addresses
-    new_locations = []
-    for address in new_addresses:
-        coords = fetch_coordinates(address)
-        if coords:
-            lat, lon = coords
-            new_locations.append(Location(
-                address=address,
-                lat=lat,
-                lon=lon
-            ))
-        else:
-            new_locations.append(
-                Location(address=address),
-                lat=None,
-                lon=None
-            )
-    if new_locations:
-        Location.objects.bulk_create(new_locations)
-        existed_locations.extend(new_locations)
-    for order in orders:
-        order.client_coords = None
-        if order.assigned_restaurant:
+
+    restaurant_index = get_restaurant_index()
+    for order in unassigned_orders:
+        order.coords_not_found = (
+            order.address in failed_addresses
+            or (order.address in customer_coords
+                and customer_coords[order.address] is None)
+        )
+        order.coords_pending = (order.address not in customer_coords
+                                and not order.coords_not_found)
+        client_coords = customer_coords.get(order.address)
+        candidates = {restaurant.id: restaurant for restaurant
+                      in available_restaurants[order.id]}
+        if not client_coords:
+            order.restaurants = [(restaurant, None) for restaurant
+                                 in candidates.values()]
             continue
-        if order.address in existed_addresses:
-            order.client_coords = existed_locations[order.address]
-        order.restaurants = [copy.copy(restaurant) for restaurant in
-                                restaurants.available(order)]
-        for restaurant in order.restaurants:
-            restaurant_coords = restaurant.lat, restaurant.lon
-            if all(coord for coord in order.client_coords) and \
-                all(coord for coord in restaurant_coords):
-                try:
-                    restaurant.distance = distance.distance(
-                        restaurant_coords, order.client_coords
-                    ).km
-                except ValueError:
-                    restaurant.distance = None
-            else:
-                restaurant.distance = None
-        if all(restaurant.distance for restaurant
-                in order.restaurants):
-            order.restaurants.sort(key=lambda restaurant:
-                                    restaurant.distance)
+        nearest = restaurant_index.nearest(
+            *client_coords,
+            k=settings.ORDER_RESTAURANTS_LIMIT,
+            radius_km=settings.ORDER_RESTAURANTS_RADIUS_KM,
+            keys=candidates.keys(),
+        )
+        order.restaurants = [(candidates[restaurant_id], km)
+                             for restaurant_id, km in nearest]
+        order.restaurants += [
+            (restaurant, None) for restaurant_id, restaurant
+            in candidates.items() if restaurant_id not in restaurant_index
+        ]
+    for order in orders:
         order.visual_status = order.get_status_display()
         order.visual_payment = order.get_payment_display()
+
+
+def failed_geocoding(addresses):
+    """Return the addresses the geocoding queue has given up on for now."""
+    if not addresses:
+        return set()
+    keys = {address_key(address): address for address in addresses}
+    failed_keys = GeocodingJob.objects.filter(
+        key__in=keys, status=GeocodingJob.FAILED,
+    ).values_list('key', flat=True)
+    return {keys[key] for key in failed_keys}
+
+
+LAST_ORDER_CHANGE_KEY = 'last_order_change'
+# cursor of a board opened before any order was placed
+EARLIEST_CHANGE = datetime.min.replace(tzinfo=timezone.utc)
+
+
+def encode_change_cursor(updated_at, order_id):
+    return f'{updated_at.isoformat()}|{order_id}'
+
+
+def decode_change_cursor(cursor):
+    updated_at, order_id = cursor.split('|')
+    updated_at = datetime.fromisoformat(updated_at)
+    if updated_at.tzinfo is None:
+        raise ValueError('cursor time has no offset')
+    return updated_at, int(order_id)
+
+
+def last_order_change():
+    """Return when any order last changed.
+
+    The answer is shared through the cache for ORDERS_POLL_INTERVAL, so all
+    waiting boards cost one query per interval however many there are.
+    """
+    return cache.get_or_set(
+        LAST_ORDER_CHANGE_KEY,
+        lambda: Order.objects.aggregate(latest=Max('updated_at'))['latest'],
+        timeout=settings.ORDERS_POLL_INTERVAL,
+    )
+
+
+def collect_order_changes(request, filters, updated_at, order_id):
+    """Render orders changed after the cursor as the filtered board shows them.
+
+    Returns the changes and the new cursor. Orders the board's filters no
+    longer match are reported as not visible, so the board drops their rows.
+    """
+    latest = last_order_change()
+    if latest is None or latest < updated_at:
+        return [], (updated_at, order_id)
+    changed_orders = list(
+        Order.objects.filter(
+            Q(updated_at__gt=updated_at) |
+            Q(updated_at=updated_at, id__gt=order_id)
+        )
+        .order_by('updated_at', 'id')
+        .values_list('id', 'updated_at')[:settings.ORDERS_PAGE_SIZE]
+    )
+    if not changed_orders:
+        return [], (updated_at, order_id)
+    visible_orders = list(
+        filters.filter(Order.objects.filter(
+            pk__in=[order_id for order_id, _ in changed_orders]
+        ))
+        .select_related('assigned_restaurant')
+        .prefetch_related('elements__product')
+    )
+    prepare_orders(visible_orders)
+    visible_orders = {order.id: order for order in visible_orders}
+    changes = []
+    for order_id, _ in changed_orders:
+        order = visible_orders.get(order_id)
+        changes.append({
+            'id': order_id,
+            'visible': order is not None,
+            'html': render_to_string('order_row.html', {'item': order},
+                                     request=request) if order else None,
+        })
+    last_order_id, last_updated_at = changed_orders[-1]
+    return changes, (last_updated_at, last_order_id)
+
+
+@user_passes_test(is_manager, login_url='restaurateur:login')
+def view_orders(request):
+    filters = OrdersFilter(request.GET)
+    if not filters.is_valid():
+        return render(request, template_name='order_items.html', context={
+            'filters': filters,
+            'order_items': [],
+        })
+    # taken before the page, so changes made while it renders are not lost
+    latest_change = last_order_change() or EARLIEST_CHANGE
+    page_size = settings.ORDERS_PAGE_SIZE
+    orders = list(
+        filters.filter(Order.objects.all())
+               .select_related('assigned_restaurant')
+               .prefetch_related('elements__product')[:page_size + 1]
+    )
+    next_page_url = None
+    if len(orders) > page_size:
+        orders = orders[:page_size]
+        params = request.GET.copy()
+        params['after'] = encode_cursor(orders[-1])
+        next_page_url = f'?{params.urlencode()}'
+    prepare_orders(orders)
+    first_page_params = request.GET.copy()
+    first_page_params.pop('after', None)
+    updates_params = first_page_params.copy()
+    updates_params['since'] = encode_change_cursor(latest_change, 0)
     return render(request, template_name='order_items.html', context={
-        "order_items": orders
+        'filters': filters,
+        'order_items': orders,
+        'next_page_url': next_page_url,
+        'first_page_url': f'?{first_page_params.urlencode()}',
+        'updates_url': '{}?{}'.format(reverse('restaurateur:order_updates'),
+                                      updates_params.urlencode()),
+    })
+
+
+async def order_updates(request):
+    """Report changes of the orders board after the since cursor.
+
+    Under ASGI a waiting board holds no worker thread, so the view waits
+    for a change up to ORDERS_POLL_TIMEOUT seconds and the board asks again
+    at once. Under WSGI waiting would hold a sync worker per open board, so
+    the view answers straight away and retry_after tells the board to ask
+    again in ORDERS_POLL_TIMEOUT seconds.
+    """
+    if not await database_sync_to_async(is_manager)(request.user):
+        return HttpResponseForbidden()
+    params = request.GET.copy()
+    params.pop('after', None)
+    filters = OrdersFilter(params)
+    try:
+        cursor = decode_change_cursor(request.GET.get('since', ''))
+    except ValueError:
+        return JsonResponse({'detail': 'Неверный курсор.'}, status=400)
+    if not await database_sync_to_async(filters.is_valid)():
+        return JsonResponse({'errors': filters.errors}, status=400)
+
+    long_poll = isinstance(request, ASGIRequest)
+    deadline = monotonic() + settings.ORDERS_POLL_TIMEOUT
+    while True:
+        changes, cursor = await database_sync_to_async(
+            collect_order_changes,
+        )(request, filters, *cursor)
+        if changes or not long_poll or monotonic() >= deadline:
+            break
+        await asyncio.sleep(settings.ORDERS_POLL_INTERVAL)
+    return JsonResponse({
+        'cursor': encode_change_cursor(*cursor),
+        'orders': changes,
+        'retry_after': (0 if long_poll or changes
+                        else settings.ORDERS_POLL_TIMEOUT),
     })
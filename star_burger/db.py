@@ -0,0 +1,28 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections, connection
+
+from .metrics import current_stats
+
+
+def database_sync_to_async(func):
+    """Run ORM code from async code in a thread of the executor pool.
+
+    Unlike the thread_sensitive default, calls do not queue up behind each
+    other on one thread. Each pool thread has its own connection, so stale
+    ones are closed around the call, and the queries are counted towards
+    the current request's metrics.
+    """
+    @wraps(func)
+    def run(*args, **kwargs):
+        close_old_connections()
+        try:
+            stats = current_stats.get()
+            if stats is None:
+                return func(*args, **kwargs)
+            with connection.execute_wrapper(stats):
+                return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(run, thread_sensitive=False)
@@ -0,0 +1,340 @@
+import asyncio
+import cProfile
+import glob
+import json
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter, strftime
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse, HttpResponseForbidden
+
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# gauges of a process that has not written its file for so long are dropped
+GAUGE_MAX_AGE = 60
+
+
+class Registry:
+    """Counters, histograms and gauges in the Prometheus format.
+
+    Every process counts on its own. With METRICS_DIR set, each process,
+    geocode_worker included, writes its numbers to a file of its own there
+    at most every METRICS_FLUSH_SECONDS, and render() adds up the files of
+    all processes, so a scrape gets the same totals whichever gunicorn
+    worker answers it. Counters of stopped processes stay in the sum, so
+    the totals never go down; gauges are the maximum over live processes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._counters = defaultdict(float)
+        self._histograms = {}
+        self._gauges = {}
+        self._started_at = time.time_ns()
+        self._flushed_at = None
+
+    def describe(self, name, kind, help_text):
+        self._metrics[name] = (kind, help_text)
+
+    def gauge(self, name, help_text, callback):
+        """Register a gauge whose value is read from callback on render."""
+        self.describe(name, 'gauge', help_text)
+        self._gauges[name] = callback
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._counters[name, tuple(sorted(labels.items()))] += value
+
+    def observe(self, name, value, **labels):
+        key = name, tuple(sorted(labels.items()))
+        with self._lock:
+            histogram = self._histograms.setdefault(
+                key, [0] * (len(DURATION_BUCKETS) + 1) + [0.0],
+            )
+            histogram[bisect_left(DURATION_BUCKETS, value)] += 1
+            histogram[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            counters = [[name, labels, value]
+                        for (name, labels), value in self._counters.items()]
+            histograms = [[name, labels, list(histogram)]
+                          for (name, labels), histogram
+                          in self._histograms.items()]
+        return {
+            'written_at': time.time(),
+            'counters': counters,
+            'histograms': histograms,
+            'gauges': {name: callback()
+                       for name, callback in self._gauges.items()},
+        }
+
+    def flush(self, force=False):
+        """Write this process's numbers to METRICS_DIR, if it is set."""
+        directory = settings.METRICS_DIR
+        if not directory:
+            return
+        now = time.monotonic()
+        if not force and self._flushed_at is not None and \
+                now - self._flushed_at < settings.METRICS_FLUSH_SECONDS:
+            return
+        self._flushed_at = now
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory,
+                            f'{os.getpid()}-{self._started_at}.json')
+        temporary_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(temporary_path, 'w') as output:
+            json.dump(self.snapshot(), output)
+        os.replace(temporary_path, path)
+
+    def collect(self):
+        """Return the snapshots of all processes, or of this one alone."""
+        if not settings.METRICS_DIR:
+            return [self.snapshot()]
+        self.flush(force=True)
+        snapshots = []
+        for path in glob.glob(os.path.join(settings.METRICS_DIR, '*.json')):
+            try:
+                with open(path) as snapshot:
+                    snapshots.append(json.load(snapshot))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self):
+        counters = defaultdict(float)
+        histograms = {}
+        gauges = {}
+        now = time.time()
+        for snapshot in self.collect():
+            for name, labels, value in snapshot['counters']:
+                counters[name, as_labels(labels)] += value
+            for name, labels, histogram in snapshot['histograms']:
+                key = name, as_labels(labels)
+                total = histograms.get(key, [0] * len(histogram))
+                histograms[key] = [a + b for a, b in zip(total, histogram)]
+            if now - snapshot['written_at'] > GAUGE_MAX_AGE:
+                continue
+            for name, value in snapshot['gauges'].items():
+                gauges[name] = max(gauges.get(name, value), value)
+        samples = defaultdict(list)
+        for (name, labels), value in sorted(counters.items()):
+            samples[name].append(f'{name}{format_labels(labels)} {value:g}')
+        for (name, labels), histogram in sorted(histograms.items()):
+            cumulative = 0
+            bounds = [f'{bound:g}' for bound in DURATION_BUCKETS] + ['+Inf']
+            for bound, count in zip(bounds, histogram[:-1]):
+                cumulative += count
+                samples[name].append(
+                    f'{name}_bucket{format_labels(labels + (("le", bound),))}'
+                    f' {cumulative}'
+                )
+            samples[name].append(
+                f'{name}_sum{format_labels(labels)} {histogram[-1]:g}'
+            )
+            samples[name].append(
+                f'{name}_count{format_labels(labels)} {cumulative}'
+            )
+        for name, value in sorted(gauges.items()):
+            samples[name].append(f'{name} {value:g}')
+
+        lines = []
+        for name, (kind, help_text) in sorted(self._metrics.items()):
+            if name not in samples:
+                continue
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.extend(samples[name])
+        return '\n'.join(lines) + '\n'
+
+
+def as_labels(pairs):
+    """Labels as tuples again after a round trip through JSON."""
+    return tuple((key, value) for key, value in pairs)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(key, str(value).replace('\\', r'\\')
+                                        .replace('"', r'\"')
+                                        .replace('\n', r'\n'))
+        for key, value in labels
+    )
+    return f'{{{pairs}}}'
+
+
+registry = Registry()
+registry.describe('starburger_http_requests_total', 'counter',
+                  'Обработанные запросы')
+registry.describe('starburger_http_request_duration_seconds', 'histogram',
+                  'Время ответа')
+registry.describe('starburger_db_queries_total', 'counter',
+                  'SQL-запросы, выполненные при обработке запросов')
+registry.describe('starburger_db_query_seconds_total', 'counter',
+                  'Время SQL-запросов при обработке запросов')
+registry.describe('starburger_geocoder_requests_total', 'counter',
+                  'Запросы к геокодеру')
+registry.describe('starburger_geocoder_request_duration_seconds', 'histogram',
+                  'Время ответа геокодера')
+
+
+class RequestStats:
+    def __init__(self):
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.geocoder_calls = 0
+        self.geocoder_seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started_at = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_queries += 1
+            self.db_seconds += perf_counter() - started_at
+
+
+current_stats = ContextVar('current_stats', default=None)
+
+
+@contextmanager
+def track_geocoder_call():
+    started_at = perf_counter()
+    outcome = 'ok'
+    try:
+        yield
+    except BaseException:
+        outcome = 'error'
+        raise
+    finally:
+        elapsed = perf_counter() - started_at
+        registry.inc('starburger_geocoder_requests_total', outcome=outcome)
+        registry.observe('starburger_geocoder_request_duration_seconds',
+                         elapsed)
+        stats = current_stats.get()
+        if stats is not None:
+            stats.geocoder_calls += 1
+            stats.geocoder_seconds += elapsed
+
+
+def server_timing(total, stats):
+    return ', '.join([
+        f'app;dur={total * 1000:.1f}',
+        f'db;dur={stats.db_seconds * 1000:.1f};desc="{stats.db_queries} '
+        f'queries"',
+        f'geocoder;dur={stats.geocoder_seconds * 1000:.1f};'
+        f'desc="{stats.geocoder_calls} calls"',
+    ])
+
+
+class MetricsMiddleware:
+    """Records time, SQL and geocoder usage of every request.
+
+    Numbers go to /metrics and to the Server-Timing header. A share of
+    requests, PROFILE_SAMPLE_RATE, runs under cProfile and the profile is
+    saved to PROFILE_DIR if the request took longer than
+    PROFILE_THRESHOLD_MS. Async requests are not profiled, since cProfile
+    would mix in whatever else the event loop runs meanwhile.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        profiler = None
+        if random.random() < settings.PROFILE_SAMPLE_RATE:
+            profiler = cProfile.Profile()
+        started_at = perf_counter()
+        try:
+            with connection.execute_wrapper(stats):
+                if profiler:
+                    response = profiler.runcall(self.get_response, request)
+                else:
+                    response = self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        total = perf_counter() - started_at
+        self.record(request, response, total, stats)
+        if profiler and total * 1000 >= settings.PROFILE_THRESHOLD_MS:
+            dump_profile(profiler, view_name(request))
+        return response
+
+    async def __acall__(self, request):
+        # ORM calls made through database_sync_to_async count their queries
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        started_at = perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        self.record(request, response, perf_counter() - started_at, stats)
+        return response
+
+    def record(self, request, response, total, stats):
+        view = view_name(request)
+        registry.inc('starburger_http_requests_total', view=view,
+                     method=request.method, status=response.status_code)
+        registry.observe('starburger_http_request_duration_seconds', total,
+                         view=view)
+        registry.inc('starburger_db_queries_total', stats.db_queries,
+                     view=view)
+        registry.inc('starburger_db_query_seconds_total', stats.db_seconds,
+                     view=view)
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = server_timing(total, stats)
+        registry.flush()
+
+
+def view_name(request):
+    return getattr(request.resolver_match, 'view_name', None) or 'unknown'
+
+
+def dump_profile(profiler, view):
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    filename = '{}-{}-{}.prof'.format(
+        strftime('%Y%m%d-%H%M%S'),
+        view.replace(':', '-'),
+        threading.get_ident(),
+    )
+    profiler.dump_stats(os.path.join(settings.PROFILE_DIR, filename))
+
+
+def metrics_allowed(request):
+    """Let in the token holder, or internal clients if there is no token.
+
+    A request passed on by a proxy comes from the proxy's address, so one
+    with X-Forwarded-For never counts as internal.
+    """
+    token = settings.METRICS_TOKEN
+    if token:
+        return request.headers.get('Authorization') == f'Bearer {token}'
+    return (request.META.get('REMOTE_ADDR') in settings.INTERNAL_IPS
+            and 'X-Forwarded-For' not in request.headers)
+
+
+def metrics_view(request):
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(),
+                        content_type='text/plain; version=0.0.4')
@@ -0,0 +1,17 @@
+from rollbar.contrib.django.middleware import (
+    RollbarNotifierMiddlewareExcluding404,
+)
+
+
+class RollbarNotifierMiddleware(RollbarNotifierMiddlewareExcluding404):
+    """Rollbar's middleware that lets async requests pass straight through.
+
+    Rollbar's own class runs its no-op process_response on the single thread
+    Django keeps for sync code, so under ASGI every request queued for that
+    thread. Here only process_exception is left, which Django calls for a
+    failed request alone.
+    """
+
+    def __call__(self, request):
+        # with an async get_response this returns the coroutine to await
+        return self.get_response(request)
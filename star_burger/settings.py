@@ -1,4 +1,5 @@
 import os
+from datetime import timedelta
 
 import dj_database_url
 import rollbar
@@ -18,6 +19,58 @@ SECRET_KEY = env('SECRET_KEY')
 DEBUG = env.bool('DEBUG', False)
 
 GEOCODER_TOKEN = env.str('GEOCODER_TOKEN')
+GEOCODER_URL = env.str('GEOCODER_URL', 'https://geocode-maps.yandex.ru/1.x')
+GEOCODER_BACKEND = env.str('GEOCODER_BACKEND',
+                           'locations.locator.request_coordinates')
+GEOCODER_CONNECT_TIMEOUT = env.float('GEOCODER_CONNECT_TIMEOUT', 3.05)
+GEOCODER_READ_TIMEOUT = env.float('GEOCODER_READ_TIMEOUT', 5)
+GEOCODER_RETRIES = env.int('GEOCODER_RETRIES', 2)
+GEOCODER_RETRY_BACKOFF = env.float('GEOCODER_RETRY_BACKOFF', 0.5)
+GEOCODER_POOL_SIZE = env.int('GEOCODER_POOL_SIZE', 10)
+GEOCODER_BREAKER_THRESHOLD = env.int('GEOCODER_BREAKER_THRESHOLD', 5)
+GEOCODER_BREAKER_RESET_SECONDS = env.float('GEOCODER_BREAKER_RESET_SECONDS',
+                                           30)
+GEOCODER_FAKE_LATENCY_MS = env.int('GEOCODER_FAKE_LATENCY_MS', 0)
+GEOCODER_FAKE_ERROR_RATE = env.float('GEOCODER_FAKE_ERROR_RATE', 0)
+GEOCODER_FAKE_NOT_FOUND_RATE = env.float('GEOCODER_FAKE_NOT_FOUND_RATE', 0)
+GEOCODER_CACHE_SIZE = env.int('GEOCODER_CACHE_SIZE', 4096)
+GEOCODER_CACHE_TTL = timedelta(days=env.int('GEOCODER_CACHE_TTL_DAYS', 30))
+GEOCODER_LOCAL_CACHE_TTL = timedelta(
+    seconds=env.int('GEOCODER_LOCAL_CACHE_TTL_SECONDS', 60)
+)
+GEOCODER_NEGATIVE_CACHE_TTL = timedelta(
+    hours=env.int('GEOCODER_NEGATIVE_CACHE_TTL_HOURS', 24)
+)
+
+CACHES = {
+    'default': {
+        'BACKEND': env.str('CACHE_BACKEND',
+                           'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': env.str('CACHE_LOCATION', ''),
+    },
+}
+CATALOGUE_CACHE_TIMEOUT = env.int('CATALOGUE_CACHE_TIMEOUT', 3600)
+BANNERS_CACHE_TIMEOUT = env.int('BANNERS_CACHE_TIMEOUT', 3600)
+
+ORDERS_BATCH_MAX_SIZE = env.int('ORDERS_BATCH_MAX_SIZE', 500)
+
+ORDERS_PAGE_SIZE = env.int('ORDERS_PAGE_SIZE', 50)
+ORDERS_POLL_TIMEOUT = env.float('ORDERS_POLL_TIMEOUT', 5)
+ORDERS_POLL_INTERVAL = env.float('ORDERS_POLL_INTERVAL', 1)
+ORDER_RESTAURANTS_LIMIT = env.int('ORDER_RESTAURANTS_LIMIT', 10)
+ORDER_RESTAURANTS_RADIUS_KM = env.float('ORDER_RESTAURANTS_RADIUS_KM', 50)
+DISPATCH_ON_CREATE = env.bool('DISPATCH_ON_CREATE', False)
+DISPATCH_LOAD_PENALTY_KM = env.float('DISPATCH_LOAD_PENALTY_KM', 2)
+
+ASYNC_API = env.bool('ASYNC_API', False)
+
+SERVER_TIMING = env.bool('SERVER_TIMING', True)
+METRICS_TOKEN = env.str('METRICS_TOKEN', '')
+METRICS_DIR = env.str('METRICS_DIR', '')
+METRICS_FLUSH_SECONDS = env.float('METRICS_FLUSH_SECONDS', 1)
+PROFILE_SAMPLE_RATE = env.float('PROFILE_SAMPLE_RATE', 0)
+PROFILE_THRESHOLD_MS = env.int('PROFILE_THRESHOLD_MS', 500)
+PROFILE_DIR = env.str('PROFILE_DIR', os.path.join(BASE_DIR, 'profiles'))
 
 ALLOWED_HOSTS = env.list('ALLOWED_HOSTS', ['127.0.0.1', 'localhost'])
 
@@ -32,11 +85,11 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'debug_toolbar',
     'phonenumber_field',
 ]
 
 MIDDLEWARE = [
+    'star_burger.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -44,12 +97,23 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
-    'rollbar.contrib.django.middleware.RollbarNotifierMiddlewareExcluding404',
+    'star_burger.middleware.RollbarNotifierMiddleware',
 ]
 
+if DEBUG:
+    # sync only, under ASGI it would hold a thread for every request
+    INSTALLED_APPS.append('debug_toolbar')
+    MIDDLEWARE.insert(-1, 'debug_toolbar.middleware.DebugToolbarMiddleware')
+
 ROOT_URLCONF = 'star_burger.urls'
 
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'foodcartapp.renderers.ApiJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
 DEBUG_TOOLBAR_PANELS = [
     'debug_toolbar.panels.versions.VersionsPanel',
     'debug_toolbar.panels.timer.TimerPanel',
@@ -130,9 +194,7 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
-INTERNAL_IPS = [
-    '127.0.0.1'
-]
+INTERNAL_IPS = env.list('INTERNAL_IPS', ['127.0.0.1'])
 
 
 STATICFILES_DIRS = [
@@ -0,0 +1,145 @@
+import asyncio
+import os
+import tempfile
+from time import perf_counter
+from unittest import mock
+
+from django.core.cache import cache
+from django.http import Http404, HttpResponse
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import path, reverse
+
+from locations.fake_geocoder import FakeGeocoder
+from locations.locator import GeocodingService
+from .metrics import Registry
+from .asgi import application
+
+
+async def slow_view(request):
+    await asyncio.sleep(0.5)
+    return HttpResponse('ok')
+
+
+def failing_view(request):
+    raise RuntimeError('boom')
+
+
+def missing_view(request):
+    raise Http404
+
+
+urlpatterns = [
+    path('slow/', slow_view),
+    path('failing/', failing_view),
+    path('missing/', missing_view),
+]
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_server_timing_reports_queries(self):
+        response = self.client.get(reverse('foodcartapp:product_list_api'))
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+
+    def test_metrics_endpoint(self):
+        self.client.get(reverse('foodcartapp:product_list_api'))
+        GeocodingService(fetch=FakeGeocoder()).lookup('Москва, Тверская 1')
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        self.assertIn('starburger_http_requests_total{method="GET",'
+                      'status="200",view="foodcartapp:product_list_api"}',
+                      content)
+        self.assertIn('starburger_geocoder_requests_total{outcome="ok"}',
+                      content)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_endpoint_checks_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        response = self.client.get(reverse('metrics'),
+                                   HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+    def test_metrics_endpoint_is_internal_without_token(self):
+        response = self.client.get(reverse('metrics'),
+                                   REMOTE_ADDR='203.0.113.5')
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(reverse('metrics'),
+                                   HTTP_X_FORWARDED_FOR='203.0.113.5')
+        self.assertEqual(response.status_code, 403)
+
+    def test_metrics_of_all_processes_are_added_up(self):
+        # the numbers of geocode_worker, as another process would write them
+        worker = Registry()
+        worker.describe('starburger_geocoder_requests_total', 'counter', '')
+        worker.gauge('starburger_geocoder_circuit_open', '', lambda: 1)
+        worker.inc('starburger_geocoder_requests_total', 3,
+                   outcome='from_worker')
+        with tempfile.TemporaryDirectory() as metrics_dir, \
+                override_settings(METRICS_DIR=metrics_dir):
+            worker.flush()
+            self.client.get(reverse('foodcartapp:product_list_api'))
+            content = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('starburger_geocoder_requests_total'
+                      '{outcome="from_worker"} 3', content)
+        self.assertIn('starburger_geocoder_circuit_open 1', content)
+        self.assertIn('view="foodcartapp:product_list_api"', content)
+
+    def test_slow_sampled_requests_are_profiled(self):
+        with tempfile.TemporaryDirectory() as profile_dir, \
+                override_settings(PROFILE_SAMPLE_RATE=1,
+                                  PROFILE_THRESHOLD_MS=0,
+                                  PROFILE_DIR=profile_dir):
+            self.client.get(reverse('foodcartapp:product_list_api'))
+            profiles = os.listdir(profile_dir)
+        self.assertEqual(len(profiles), 1)
+        self.assertIn('product_list_api', profiles[0])
+
+
+async def asgi_get(path):
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': b'',
+        'headers': [(b'host', b'testserver')],
+        'client': ('127.0.0.1', 50000),
+        'server': ('testserver', 80),
+    }
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await application(scope, receive, send)
+    return messages[0]['status']
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class ASGIMiddlewareTest(SimpleTestCase):
+    async def test_async_requests_run_concurrently(self):
+        # a sync only middleware would serve these one by one in 2 seconds
+        started_at = perf_counter()
+        statuses = await asyncio.gather(*[asgi_get('/slow/')
+                                          for _ in range(4)])
+        elapsed = perf_counter() - started_at
+        self.assertEqual(statuses, [200] * 4)
+        self.assertLess(elapsed, 1.5)
+
+    @mock.patch('rollbar.report_exc_info')
+    def test_rollbar_reports_errors_but_not_404(self, report_exc_info):
+        self.client.raise_request_exception = False
+        self.assertEqual(self.client.get('/missing/').status_code, 404)
+        report_exc_info.assert_not_called()
+        self.assertEqual(self.client.get('/failing/').status_code, 500)
+        report_exc_info.assert_called_once()